@@ -1,8 +1,11 @@
-import stormpy, math
-import gc
+import stormpy, math, re, json, os, tarfile, tempfile
+import numpy as np
 import random
 import stormpy.simulator
 
+from resultStore import getStored, putStored, queryKey
+from instrumentation import phase, instrumented
+
 def simulateModel(model,scheduler=None):
 	simulator = stormpy.simulator.create_simulator(model)
 	paths = []
@@ -45,38 +48,250 @@ def investigateModel(model):
 	for state in model.states:
 		print("State", state, "has label:", model.labeling.get_labels_of_state(state))
 
+def parseProperties(formula, prismProgram = None):
+	if prismProgram is None: # the model was built without a PRISM program, so win and loss are labels
+		formula = re.sub(r'(?<!")\b(win|loss)\b(?!")', r'"\1"', formula)
+		return stormpy.parse_properties_without_context(formula)
+	return stormpy.parse_properties(formula, prismProgram)
+
+def loadPrismProgram(prismFile): # a PRISM program, parsed if prismFile is the path of a PRISM file
+	if isinstance(prismFile, stormpy.PrismProgram):
+		return prismFile
+	with phase("parse"):
+		return stormpy.parse_prism_program(prismFile)
+
+def getStatePositions(model): # maps the states that are not end states to their (x,y), using the state valuations
+	positions = {}
+	for state in range(model.nr_states):
+		valuation = json.loads(str(model.state_valuations.get_json(state)))
+		if not valuation["end"]:
+			positions[state] = (valuation["x"],valuation["y"])
+	return positions
+
+MINMAX_METHODS = {
+	'vi': stormpy.MinMaxMethod.value_iteration,
+	'ii': stormpy.MinMaxMethod.interval_iteration,
+	'svi': stormpy.MinMaxMethod.sound_value_iteration,
+	'ovi': stormpy.MinMaxMethod.optimistic_value_iteration,
+	'pi': stormpy.MinMaxMethod.policy_iteration,
+	'lp': stormpy.MinMaxMethod.linear_programming,
+	'topological': stormpy.MinMaxMethod.topological,
+}
+SOUND_METHODS = ['ii', 'svi', 'ovi'] # also make the markov chain checks sound
+BUILD_ENGINES = ['sparse', 'dd', 'hybrid']
+
+class StormOptions():
+	"""
+	Settings of the storm calls: method and precision of the MDP solver, and the engine
+	used to build and check the model of a PRISM file. None keeps the storm default.
+	Only getValue of frozenLakeStorm supports the dd and hybrid engines, the conditioned
+	models need an explicit (sparse) model.
+	"""
+	def __init__(self, method = None, precision = None, engine = 'sparse'):
+		if method is not None and method not in MINMAX_METHODS:
+			raise Exception("Unknown solver method: "+str(method)+" (known: "+", ".join(MINMAX_METHODS)+")")
+		if engine not in BUILD_ENGINES:
+			raise Exception("Unknown engine: "+str(engine)+" (known: "+", ".join(BUILD_ENGINES)+")")
+		self.method = method
+		self.precision = precision
+		self.engine = engine
+
+	def getEnvironment(self): # built for each call, environments can not be sent to other processes
+		environment = stormpy.Environment()
+		solverEnvironment = environment.solver_environment
+		if self.method is not None:
+			solverEnvironment.minmax_solver_environment.method = MINMAX_METHODS[self.method]
+			if self.method in SOUND_METHODS:
+				solverEnvironment.set_force_sound()
+		if self.precision is not None:
+			solverEnvironment.minmax_solver_environment.precision = stormpy.Rational(self.precision)
+			solverEnvironment.native_solver_environment.precision = stormpy.Rational(self.precision)
+		return environment
+
+	def isDefault(self):
+		return self.method is None and self.precision is None and self.engine == 'sparse'
+
+	def __str__(self):
+		return f"method={self.method},precision={self.precision},engine={self.engine}"
+
+def modelChecking(model, property, options = None, **kwargs): # stormpy.model_checking with the environment of options
+	with phase("modelChecking") as p:
+		p.model(model)
+		if options is None:
+			return stormpy.model_checking(model, property, **kwargs)
+		return stormpy.model_checking(model, property, environment=options.getEnvironment(), **kwargs)
+
+def optionsQuery(name, options): # results obtained with other options are stored separately
+	if options is None or options.isDefault():
+		return name
+	return name+"["+str(options)+"]"
+
+def checkSparse(options):
+	if options is not None and options.engine != 'sparse':
+		raise Exception("The conditioned models need the sparse engine, not "+options.engine)
+
+def getPositionArrays(model): # states that are not end states, and their x and y, as numpy arrays
+	positions = getStatePositions(model)
+	states = np.array(list(positions.keys()), dtype=np.int64)
+	xs = np.array([x for x,y in positions.values()], dtype=np.int64)
+	ys = np.array([y for x,y in positions.values()], dtype=np.int64)
+	return states, xs, ys
+
+UMB_ARRAYS = [("state-to-choices.bin", np.uint64), ("choice-to-branches.bin", np.uint64), ("branch-to-target.bin", np.uint64), ("branch-to-probability.bin", np.float64)]
+
+def getMatrixArrays(model):
+	# CSR arrays of the transition matrix of a storm model: row group starts, row starts, columns and values.
+	# They are read in bulk from a UMB export of the model, the binary format of storm stores exactly these arrays.
+	if hasattr(stormpy, "export_to_umb"):
+		options = stormpy.UmbExportOptions()
+		options.compression = type(options.compression).NoCompression
+		with tempfile.TemporaryDirectory() as directory:
+			fname = os.path.join(directory, "model.umb")
+			stormpy.export_to_umb(model, fname, options)
+			with tarfile.open(fname) as archive:
+				arrays = [np.frombuffer(archive.extractfile(name).read(), dtype=dtype) for name,dtype in UMB_ARRAYS]
+		rowGroupStarts, rowStarts, columns = [array.astype(np.int64) for array in arrays[:3]]
+		values = arrays[3].copy()
+		if len(rowGroupStarts) == model.nr_states+1 and len(rowStarts) == model.nr_choices+1 and len(values) == model.transition_matrix.nr_entries:
+			return rowGroupStarts, rowStarts, columns, values
+	# older stormpy versions, one call per entry
+	matrix = model.transition_matrix
+	rowGroupStarts = np.array([matrix.get_row_group_start(group) for group in range(model.nr_states)]+[matrix.nr_rows], dtype=np.int64)
+	rowLengths = np.array([len(matrix.get_row(row)) for row in range(matrix.nr_rows)], dtype=np.int64)
+	rowStarts = np.concatenate(([0], np.cumsum(rowLengths)))
+	entries = [(entry.column, entry.value()) for entry in matrix] # row by row, columns increasing
+	columns = np.array([column for column,value in entries], dtype=np.int64)
+	values = np.array([value for column,value in entries], dtype=np.float64)
+	return rowGroupStarts, rowStarts, columns, values
+
+def buildMatrix(rows, columns, values, numRows, numColumns, rowGroupStarts):
+	# rows and columns must be sorted, as for SparseMatrixBuilder.add_next_value
+	builder = stormpy.SparseMatrixBuilder(rows=numRows, columns=numColumns, entries=len(values), force_dimensions=True, has_custom_row_grouping=True, row_groups=len(rowGroupStarts))
+	if hasattr(builder, "add_next_values"):
+		builder.add_next_values(rows.tolist(), columns.tolist(), values.tolist(), rowGroupStarts.tolist())
+	else: # older stormpy versions
+		entryStarts = np.searchsorted(rows, rowGroupStarts) # first entry of each row group
+		entryEnds = np.append(entryStarts[1:], len(rows))
+		for group in range(len(rowGroupStarts)):
+			builder.new_row_group(int(rowGroupStarts[group]))
+			for entry in range(entryStarts[group], entryEnds[group]):
+				builder.add_next_value(int(rows[entry]), int(columns[entry]), float(values[entry]))
+	return builder.build()
+
 class ConditionalMinDistEngine():
 
-	def __init__(self,prismFile):
-		self.prismProgram = stormpy.parse_prism_program(prismFile)
+	def __init__(self,prismFile,vectorized = True,threshold = 0.00001,distThreshold = 0.0,options = None): # path to a PRISM file, PrismProgram, or an already built SparseMdp
+		checkSparse(options)
+		self.options = options # StormOptions of the model checking calls
+		self.vectorized = vectorized # build the conditioned models with numpy instead of looping over the states
+		self.threshold = threshold # tolerance to decide if an action is Pmax-optimal, for rounding errors
+		self.distThreshold = distThreshold # tolerance to decide if an action minimizes the distance
+		self.matrixArrays = None
+		self.bestChoices = None
+		self.bestDistChoices = None
+		if isinstance(prismFile, stormpy.storage.SparseMdp):
+			self.prismProgram = None
+			self.builtModel = prismFile
+		else:
+			self.prismProgram = loadPrismProgram(prismFile)
 
 	def getValue(self,formula): # get the values for each states
-		properties = stormpy.parse_properties(formula, self.prismProgram) # formula is of the form "Pmax=?..."
-		self.model = stormpy.build_model(self.prismProgram, properties)
+		properties = parseProperties(formula, self.prismProgram) # formula is of the form "Pmax=?..."
+		if self.prismProgram is None:
+			self.model = self.builtModel
+		else:
+			options = stormpy.BuilderOptions([p.raw_formula for p in properties])
+			options.set_build_state_valuations() # needed to map states back to positions
+			with phase("build") as p:
+				self.model = p.model(stormpy.build_sparse_model_with_options(self.prismProgram, options))
 		# investigateModel(self.model)
-		result = stormpy.model_checking(self.model, properties[0], extract_scheduler=True)
+		result = modelChecking(self.model, properties[0], self.options, extract_scheduler=True)
 		self.result = result
+		self.matrixArrays = None # the masks are computed again for this result
+		self.bestChoices = None
+		self.bestDistChoices = None
 		return result
 
+	def getChoiceArrays(self): # CSR arrays of self.model and the state of each row and entry
+		if self.matrixArrays is None:
+			rowGroupStarts, rowStarts, columns, values = getMatrixArrays(self.model)
+			rowStates = np.repeat(np.arange(len(rowGroupStarts)-1), np.diff(rowGroupStarts))
+			entryRows = np.repeat(np.arange(len(rowStarts)-1), np.diff(rowStarts))
+			self.matrixArrays = (rowGroupStarts, rowStarts, columns, values, rowStates, entryRows)
+		return self.matrixArrays
+
+	@instrumented("getBestChoices")
+	def getBestChoices(self): # boolean mask over the choices of self.model: Pmax-optimal up to self.threshold
+		if self.bestChoices is None:
+			rowGroupStarts, rowStarts, columns, values, rowStates, entryRows = self.getChoiceArrays()
+			result = np.array(self.result.get_values())
+			choiceValues = np.bincount(entryRows, weights=result[columns]*values, minlength=len(rowStates))
+			bestValues = np.maximum.reduceat(choiceValues, rowGroupStarts[:-1])
+			self.bestChoices = choiceValues >= bestValues[rowStates] - self.threshold
+		return self.bestChoices
+
+	@instrumented("getBestDistChoices")
+	def getBestDistChoices(self): # boolean mask over the choices: Pmax-optimal and minimizing the distance in self.newModel, up to self.distThreshold
+		if self.bestDistChoices is None:
+			rowGroupStarts, rowStarts, columns, values, rowStates, entryRows = self.getChoiceArrays()
+			result = np.array(self.result.get_values())
+			distance = np.array(self.newResult.get_values())
+			entryStates = rowStates[entryRows]
+			newValues = values*result[columns]/np.where(result == 0, 1.0, result)[entryStates] # transitions of self.newModel
+			contributions = newValues*np.where(newValues > 0, distance[columns], 0.0) # bad successors are reached with probability 0
+			choiceValues = np.where(self.getBestChoices(), np.bincount(entryRows, weights=contributions, minlength=len(rowStates)), math.inf)
+			bestValues = np.minimum.reduceat(choiceValues, rowGroupStarts[:-1])
+			self.bestDistChoices = self.getBestChoices() & (choiceValues <= bestValues[rowStates] + self.distThreshold)
+		return self.bestDistChoices
+
+	def getChoiceIds(self, state, mask): # local ids of the actions of state that are in a mask over the choices
+		start = self.getChoiceArrays()[0][state.id]
+		return [action.id for action in state.actions if mask[start+action.id]]
+
 	def getBestActionIds(self,state): # returns list of integers for best actions from a state
-		threshold = 0.00001 # I need this for some rounding errors
-		bestActionIds = []
-		bestValue = 0  # assuming we are maximizing the probability
-		for action in state.actions:
-			value = 0
-			for transition in action.transitions:
-				value += self.result.at(transition.column)*transition.value()
-			# print("---->",action.id,value)
-			if value <= bestValue + threshold and value >= bestValue - threshold:
-				bestActionIds += [action.id]
-			elif value > bestValue + threshold:
-				bestValue = value
-				bestActionIds = [action.id]
-			else:
-				pass
-		return bestActionIds
+		return self.getChoiceIds(state, self.getBestChoices())
+
+	def getConditionedMatrix(self, keepActions): # removeBadStates and removeBadStatesKeepActions on numpy arrays
+		matrix = self.model.transition_matrix
+		rowGroupStarts, rowStarts, columns, values, rowStates, entryRows = self.getChoiceArrays()
+		numRows = matrix.nr_rows
+		result = np.array(self.result.get_values())
+		entryStates = rowStates[entryRows]
+
+		# bad states, and bad actions unless they are kept, get a self-loop
+		badStates = result == 0
+		selfLoops = badStates[rowStates]
+		if not keepActions:
+			selfLoops = selfLoops | ~self.getBestChoices()
+		newValues = values*result[columns]/np.where(badStates, 1.0, result)[entryStates]
+		kept = ~selfLoops[entryRows] & (newValues != 0)
+		loopRows = np.flatnonzero(selfLoops)
+		rows = np.concatenate((entryRows[kept], loopRows))
+		newColumns = np.concatenate((columns[kept], rowStates[loopRows]))
+		newValues = np.concatenate((newValues[kept], np.ones(len(loopRows))))
+		order = np.lexsort((newColumns, rows))
+		return buildMatrix(rows[order], newColumns[order], newValues[order], numRows, matrix.nr_columns, rowGroupStarts[:-1])
+
+	@instrumented("buildConditionedModel")
+	def buildConditionedModel(self, transition_matrix): # MDP with the labels of self.model and a reward of 1 per step
+
+		# keep labels of states
+		state_labeling = self.model.labeling
+
+		# not adding reward model
+		reward_models = {}
+		reward_vector = [1.0 for i in range(transition_matrix.nr_columns)]
+		reward_models["dist"] = stormpy.SparseRewardModel(optional_state_reward_vector=reward_vector)
+
+		# build new mdp
+		components = stormpy.SparseModelComponents(transition_matrix=transition_matrix, state_labeling=state_labeling,reward_models=reward_models, rate_transitions=False)
+		return stormpy.storage.SparseMdp(components)
 
+	@instrumented("removeBadStates")
 	def removeBadStates(self): # create a new model by removing states with 0 value
+		if self.vectorized:
+			self.newModel = self.buildConditionedModel(self.getConditionedMatrix(keepActions=False))
+			return self.newModel
 
 		# building new transition matrix
 		numColumns = self.model.transition_matrix.nr_columns # we need to fix the columns so that storm does not remove disconnected states while building MDP
@@ -121,22 +336,16 @@ class ConditionalMinDistEngine():
 
 		transition_matrix = builder.build()
 
-		# keep labels of states
-		state_labeling = self.model.labeling
-
-		# not adding reward model
-		reward_models = {}
-		reward_vector = [1.0 for i in range(numColumns)]
-		reward_models["dist"] = stormpy.SparseRewardModel(optional_state_reward_vector=reward_vector)
-
-		# build new mdp
-		components = stormpy.SparseModelComponents(transition_matrix=transition_matrix, state_labeling=state_labeling,reward_models=reward_models, rate_transitions=False)
-		newModel = stormpy.storage.SparseMdp(components)
+		newModel = self.buildConditionedModel(transition_matrix)
 		self.newModel = newModel
 		# investigateModel(newModel)
 		return (newModel)
 
+	@instrumented("removeBadStatesKeepActions")
 	def removeBadStatesKeepActions(self): # create a new model by removing states with 0 value, but keeping suboptimal actions
+		if self.vectorized:
+			self.newModelConditional = self.buildConditionedModel(self.getConditionedMatrix(keepActions=True))
+			return self.newModelConditional
 
 		# building new transition matrix
 		numColumns = self.model.transition_matrix.nr_columns # we need to fix the columns so that storm does not remove disconnected states while building MDP
@@ -148,8 +357,6 @@ class ConditionalMinDistEngine():
 		for state in self.model.states:
 			builder.new_row_group(numChoices) # add state; create a new group of rows
 
-			bestActions = self.getBestActionIds(state)
-
 			# each row is for a choice: (state, action) pair
 			for action in state.actions:
 				if self.result.at(state) == 0: # if bad state
@@ -180,70 +387,36 @@ class ConditionalMinDistEngine():
 
 		transition_matrix = builder.build()
 
-		# keep labels of states
-		state_labeling = self.model.labeling
-
-		# not adding reward model
-		reward_models = {}
-		reward_vector = [1.0 for i in range(numColumns)]
-		reward_models["dist"] = stormpy.SparseRewardModel(optional_state_reward_vector=reward_vector)
-
-		# build new mdp
-		components = stormpy.SparseModelComponents(transition_matrix=transition_matrix, state_labeling=state_labeling,reward_models=reward_models, rate_transitions=False)
-		newModel = stormpy.storage.SparseMdp(components)
+		newModel = self.buildConditionedModel(transition_matrix)
 		self.newModelConditional = newModel
 		# investigateModel(newModel)
-		print("New model simulation:")
 		return (newModel)
 
 	def getBestDistValue(self,formula): # get the expected min distance for each states
 		# formula is of the form "Tmin=?..."
 
 		# result using our approach
-		properties = stormpy.parse_properties(formula, self.prismProgram)
-		newResult = stormpy.model_checking(self.newModel, properties[0], extract_scheduler=True)
-		scheduler = newResult.scheduler
-		dtmc = self.newModel.apply_scheduler(scheduler)
-		# simulateModel(dtmc,scheduler)
+		properties = parseProperties(formula, self.prismProgram)
+		newResult = modelChecking(self.newModel, properties[0], self.options, extract_scheduler=True)
+		# simulateModel(self.newModel.apply_scheduler(newResult.scheduler),newResult.scheduler)
 		# print(newResult.scheduler)
 		self.newResult = newResult
+		self.bestDistChoices = None
 		return newResult
 	
 	def getStormDistValue(self,formula): 
 		# get the expected min distance for each states in the MC created by storm
 		scheduler = self.result.scheduler
-		dtmc = self.newModelConditional.apply_scheduler(scheduler)
+		dtmc = self.newModelConditional.apply_scheduler(scheduler, drop_unreachable_states=False) # keep the state indices of self.model
 		# simulateModel(dtmc,scheduler)
-		properties = stormpy.parse_properties(formula, self.prismProgram)
-		newStormResult = stormpy.model_checking(dtmc, properties[0], extract_scheduler=True)
+		properties = parseProperties(formula, self.prismProgram)
+		newStormResult = modelChecking(dtmc, properties[0], self.options, extract_scheduler=True)
 		# print(newResult.scheduler)
 		self.newStormResult = newStormResult
 		return newStormResult
 
 	def getBestDistActionIds(self,state): # returns list of integers for best actions minimizing expected distance from a state
-		bestActionIds = []
-		bestValue = math.inf  # assuming we are minimizing the distance
-		# print("best actions: ",self.getBestActionIds(state))
-		for action in state.actions:
-			if action.id in self.getBestActionIds(state):
-				value = 0
-				for transition in action.transitions:
-					if self.newResult.at(transition.column) == math.inf:
-						# print(transition.value())
-						assert (transition.value() == 0) # bad states are reached with probability 0
-					else:
-						value += self.newResult.at(transition.column)*transition.value()
-				if value < bestValue:
-					bestValue = value
-					bestActionIds = [action.id]
-				elif value == bestValue:
-					bestActionIds += [action.id]
-				else:
-					pass
-				# print(state,action.id,value)
-			else:
-				pass
-		return bestActionIds
+		return self.getChoiceIds(state, self.getBestDistChoices())
 
 	def process(self, formula1, formula2):
 		self.getValue(formula1)
@@ -262,14 +435,119 @@ class ConditionalMinDistEngine():
 		distanceStorm = self.newStormResult.at(newStormInitialState)
 		return value, distance, distanceStorm
 
-def getDistValue(prismFile,formula1,formula2):
-	c = ConditionalMinDistEngine(prismFile)
-	c.process(formula1, formula2)
-	v = c.getFinalValues()
-	del c
-	gc.collect()
+	def getPositionValues(self): # same values as getFinalValues, for every position of the model
+		positions = getStatePositions(self.model)
+		values = {}
+		for state,position in positions.items():
+			values[position] = (self.result.at(state), self.newResult.at(state), self.newStormResult.at(state))
+		return values
+
+	def getValueGrids(self, height, width):
+		# (height, width) grids of the values of getPositionValues, NaN for walls and for cells that are not in the model
+		states, xs, ys = getPositionArrays(self.model)
+		grids = []
+		for result in [self.result, self.newResult, self.newStormResult]:
+			grid = np.full((height,width), np.nan)
+			grid[xs,ys] = np.array(result.get_values())[states]
+			grids.append(grid)
+		return tuple(grids)
+
+class ConditionalMinDistSession():
+	"""
+	All the values of one layout from a single parse and build of the model.
+	Pmax is computed on the first request; each conditioned model is built only when
+	its distance is asked for, and dropped as soon as that distance is known.
+	The base model is dropped by close(), or at the end of a with block.
+	"""
+	def __init__(self,prismFile,formula1 = "Pmax=? [F win]",formula2 = "Tmin=? [F win]",**engineOptions):
+		self.engine = ConditionalMinDistEngine(prismFile,**engineOptions)
+		self.formula1 = formula1
+		self.formula2 = formula2
+		self.solved = False
+		self.optResult = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def solve(self): # Pmax, shared by all the other values
+		if not self.solved:
+			self.engine.getValue(self.formula1)
+			self.initialState = self.engine.model.initial_states[0]
+			self.solved = True
+		return self.engine.result
+
+	def getDistResult(self): # minimal distance among Pmax-optimal strategies, in the MDP conditioned on winning
+		self.solve()
+		if not hasattr(self.engine, "newResult"):
+			self.engine.removeBadStates()
+			self.engine.getBestDistValue(self.formula2)
+			self.engine.newModel = None
+		return self.engine.newResult
+
+	def getStormDistResult(self): # distance of storm's Pmax strategy, in the MDP conditioned on winning
+		self.solve()
+		if not hasattr(self.engine, "newStormResult"):
+			self.engine.removeBadStatesKeepActions()
+			self.engine.getStormDistValue(self.formula2)
+			self.engine.newModelConditional = None
+		return self.engine.newStormResult
+
+	def getOptResult(self): # distance of storm's Pmax strategy in the original MDP, as in useOptStrategy.getOptDist
+		self.solve()
+		if self.optResult is None:
+			scheduler = self.engine.result.scheduler
+			assert scheduler.memoryless
+			assert scheduler.deterministic
+			dtmc = self.engine.model.apply_scheduler(scheduler, drop_unreachable_states=False)
+			properties = parseProperties(self.formula2, self.engine.prismProgram)
+			self.optResult = modelChecking(dtmc, properties[0], self.engine.options)
+		return self.optResult
+
+	def getProbability(self):
+		return self.solve().at(self.initialState)
+
+	def getDist(self):
+		return self.getDistResult().at(self.initialState)
+
+	def getStormDist(self):
+		return self.getStormDistResult().at(self.initialState)
+
+	def getOptDist(self):
+		return self.getOptResult().at(self.initialState)
+
+	def getFinalValues(self): # same as ConditionalMinDistEngine.getFinalValues
+		return self.getProbability(), self.getDist(), self.getStormDist()
+
+	def getPositionValues(self): # same as ConditionalMinDistEngine.getPositionValues
+		self.getDistResult()
+		self.getStormDistResult()
+		return self.engine.getPositionValues()
+
+	def getValueGrids(self, height, width): # same as ConditionalMinDistEngine.getValueGrids
+		self.getDistResult()
+		self.getStormDistResult()
+		return self.engine.getValueGrids(height, width)
+
+	def close(self):
+		self.engine = None
+
+def getDistValue(prismFile,formula1,formula2,key = None,options = None): # key: hash of the layout, to use the result store
+	query = queryKey(optionsQuery("getDistValue",options),formula1,formula2)
+	v = getStored(key, query)
+	if v is not None:
+		return tuple(v)
+	with ConditionalMinDistSession(prismFile,formula1,formula2,options=options) as session:
+		v = session.getFinalValues()
+	putStored(key, query, v)
 	return v
 
+def getDistPositionValues(prismFile,formula1,formula2,options = None): # getDistValue for all positions at once
+	with ConditionalMinDistSession(prismFile,formula1,formula2,options=options) as session:
+		return session.getPositionValues()
+
 	# investigateModel(c.model)
 	# print("")
 	# investigateModel(c.newModel)
@@ -1,7 +1,7 @@
 # frozenLake.py
 
 import numpy as np # type: ignore
-import random, os, sys, glob, curses
+import random, os, sys, glob, curses, hashlib
 
 from typing import TypeVar, Type, Any, Optional, Sequence, List, Tuple, Dict, Union, Generic, NoReturn
 
@@ -64,6 +64,8 @@ Grid = List[List[bool]]
 GridDistance = List[List[int]]
 
 def gridCopy(grid: Grid) -> Grid:
+	if isinstance(grid, np.ndarray):
+		return grid.copy()
 	return [[grid[i][j] for j in range(len(grid[i]))] for i in range(len(grid))]
 
 def gridStr(grid: Grid) -> str:
@@ -139,6 +141,18 @@ def getLegalStochasticActions(position: Position, walls: Grid, action: str) -> L
 	# r.append('Stop')
 	return r
 
+INTENDED_WEIGHT = 10.0 # weight of the intended direction
+SLIP_WEIGHT = 1.0 # weight of every other legal non-reverse direction
+
+def getStochasticDistribution(position: Position, walls: Grid, action: str) -> List[Tuple[str, float]]:
+	r=[]
+	total=0.0
+	for label in getLegalStochasticActions(position,walls,action):
+		weight = INTENDED_WEIGHT if label == action else SLIP_WEIGHT
+		r.append((label,weight))
+		total+=weight
+	return [(label,weight/total) for label,weight in r]
+
 def isLegalAction(position: Position, action: str, walls: Grid) -> bool:
 	X=len(walls)
 	Y=len(walls[0])
@@ -240,6 +254,27 @@ def fileStr(walls,holes,targets,position,drawHorizon,discount = 1):
 	s += ' '.join(predicates)
 	return s
 
+def layoutHash(walls: Grid, holes: Grid, targets: Grid, position: Position) -> str:
+	# same hash for the same MDP, whatever the name of the layout file
+	s = fullGridStr(walls,holes,targets)+'\nposition '+fileStrPos(position)+'\nslip '+str(INTENDED_WEIGHT)+' '+str(SLIP_WEIGHT)
+	return hashlib.sha256(s.encode()).hexdigest()
+
+def gridsFromFile(fname): # reads walls, holes, targets and initial position of a layout file
+	f = open(fname)
+	FILE_SEPARATOR="\nInitPredicates\n"
+	s = f.read().split(FILE_SEPARATOR)[0]
+	FILE_SEPARATOR="\nInitPosition\n"
+	s = s.split(FILE_SEPARATOR)
+	f.close()
+	mdpDescription = s[0]
+	position = posFromFileStr(s[1])
+	FILE_SEPARATOR="\nParameters\n"
+	mdpDescription = mdpDescription.split(FILE_SEPARATOR)
+	walls=wallsFromStr(mdpDescription[0])
+	holes=holesFromStr(mdpDescription[0])
+	targets=targetsFromStr(mdpDescription[0])
+	return (walls, holes, targets, position)
+
 def createLayouts (n,height,width,layouts_dir,p=0.9,prefix = ''): # bigger value of p = easier layouts
 	util.mkdir(layouts_dir)
 	fileList = []
@@ -264,15 +299,15 @@ def createRandomGrid (n,height,width,p=0.9,prefix = ''): # bigger value of p = e
 
 Grid = List[List[bool]]
 
+# Grids are lists of lists of booleans, or (height, width) np.bool_ arrays: the functions of this
+# file only index them with grid[i][j], so they accept both.
+
+def gridsToBoolArray(walls: Grid, holes: Grid, targets: Grid):
+	# contiguous (3, height, width) np.bool_ array of walls, holes and targets, its planes can be used as grids
+	return np.ascontiguousarray(np.array([walls,holes,targets], dtype=np.bool_))
+
 def gridToArray(grid:Grid): # creates numpy arrays from grids
-	X = len(grid)
-	Y=len(grid[0])
-	array = np.zeros((1,X,Y))
-	for i in range(X):
-		for j in range(Y):
-			if grid[i][j]:
-				array[0][i][j] = 1
-	return array
+	return np.asarray(grid, dtype=np.float64)[np.newaxis]
 
 def addPositionToArray(array, position):
 	x,y = position
@@ -297,11 +332,7 @@ def addActionToArray(array, action:str):
 	return np.concatenate((array , aArray), axis = 0)
 
 def gridsToArray(walls, holes, targets):
-	wallArray = gridToArray(walls)
-	holeArray = gridToArray(holes)
-	targetArray = gridToArray(targets)
-	layoutArray =  np.concatenate((wallArray , holeArray, targetArray), axis = 0)
-	return layoutArray
+	return np.array([walls,holes,targets], dtype=np.float64)
 
 def gridsToArrayWithPos(walls, holes, targets, position):
 	layoutArray = gridsToArray(walls, holes, targets)
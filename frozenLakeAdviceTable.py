@@ -0,0 +1,135 @@
+# frozenLakeAdviceTable.py
+
+# Tables d[position] -> [(probability, distance)] for the actions East, West, North, South,
+# as consumed by MDPDictActionAdvice, MDPDictActionStrategy and MDPDictTraceEngine.
+# The table of a layout is computed for every free cell in one pass and saved next to the
+# .lay file (layout.advice.npz), so that simulations with a Dict strategy need no solver.
+#
+# Terminal cells get the value of the cell for every action, walls are not in the table.
+
+import numpy as np
+import os, sys, glob, math
+from collections.abc import Mapping
+
+from frozenLake import *
+
+TABLE_ACTIONS = ['East','West','North','South'] # order of the actions in the table
+
+NATIVE_ENGINE = 'native' # frozenLakeNative, numpy only
+STORM_ENGINE = 'storm' # StormOracle of frozenLakeStorm
+
+def createAdviceArrayNative(walls,holes,targets):
+	from frozenLakeNative import CompiledLayout, NativeConditionalMinDistEngine, ACTIONS, PMAX_FORMULA, TMIN_FORMULA
+	height = len(walls)
+	width = len(walls[0])
+	values = np.full((height,width,len(TABLE_ACTIONS),2), np.nan)
+	free = [(i,j) for i in range(height) for j in range(width) if not walls[i][j]]
+	if free == []:
+		return values
+	c = CompiledLayout(walls,holes,targets,free[0]) # the initial position is not used
+	engine = NativeConditionalMinDistEngine(c)
+	engine.process(PMAX_FORMULA,TMIN_FORMULA)
+	probability = engine.result
+	distance = engine.newResult
+
+	# one step backups for all choices at once, conditioned on winning like getActionDistValues
+	columns = c.transitionColumns
+	good = probability[columns] > 0
+	with np.errstate(invalid='ignore'):
+		weights = np.where(good, c.transitionProbabilities*probability[columns], 0.0)
+		value = c.choiceSums(weights)
+		distanceSum = c.choiceSums(np.where(good, weights*distance[columns], 0.0))
+	choiceDistance = np.where(value > 0, 1+distanceSum/np.where(value > 0, value, 1.0), math.inf)
+
+	rows = c.statePositions[:,0]
+	cols = c.statePositions[:,1]
+	values[rows,cols,:,0] = 0.0 # illegal actions
+	values[rows,cols,:,1] = math.inf
+	labeled = c.choiceActions >= 0
+	actionIndex = np.array([TABLE_ACTIONS.index(action) for action in ACTIONS])[c.choiceActions[labeled]]
+	positions = c.statePositions[c.choiceStates[labeled]]
+	values[positions[:,0],positions[:,1],actionIndex,0] = np.where(value[labeled] > 0, value[labeled], 0.0)
+	values[positions[:,0],positions[:,1],actionIndex,1] = choiceDistance[labeled]
+	terminal = c.win | c.loss
+	values[rows[terminal],cols[terminal],:,0] = probability[terminal][:,None]
+	values[rows[terminal],cols[terminal],:,1] = distance[terminal][:,None]
+	return values
+
+def createAdviceArrayStorm(walls,holes,targets,builder = None):
+	from frozenLakeStorm import StormOracle, SPARSE_BUILDER
+	if builder is None:
+		builder = SPARSE_BUILDER # the PRISM path fails on large grids
+	height = len(walls)
+	width = len(walls[0])
+	values = np.full((height,width,len(TABLE_ACTIONS),2), np.nan)
+	oracle = StormOracle(walls,holes,targets,builder) # solves again only for cells not reachable from the previous ones
+	for i in range(height):
+		for j in range(width):
+			if not walls[i][j]:
+				values[i][j] = [actionValue[:2] for actionValue in oracle.getActionDistValues((i,j))]
+	return values
+
+def createAdviceArray(walls,holes,targets,engine = NATIVE_ENGINE):
+	# (height, width, 4, 2) array of (probability, distance), NaN for walls
+	if engine == NATIVE_ENGINE:
+		return createAdviceArrayNative(walls,holes,targets)
+	elif engine == STORM_ENGINE:
+		return createAdviceArrayStorm(walls,holes,targets)
+	else:
+		raise Exception("Unknown engine: "+str(engine))
+
+def adviceTableFile(layout):
+	return os.path.splitext(layout)[0]+'.advice.npz'
+
+def saveAdviceArray(values,fname,engine = NATIVE_ENGINE):
+	np.savez_compressed(fname, values=values, engine=np.array(engine))
+
+class AdviceTable(Mapping):
+	"""
+	Read only dict position -> [(probability, distance)] * 4 backed by a .advice.npz file.
+	The file is only read on the first access.
+	"""
+	def __init__(self,fname):
+		self.fname = fname
+		self.values = None
+
+	def load(self):
+		if self.values is None:
+			with np.load(self.fname) as data:
+				self.values = data['values']
+		return self.values
+
+	def __getitem__(self,position):
+		values = self.load()
+		x,y = position
+		if not (0 <= x < values.shape[0] and 0 <= y < values.shape[1]) or np.isnan(values[x,y,0,0]):
+			raise KeyError(position)
+		return [(float(p),float(d)) for p,d in values[x,y]]
+
+	def __iter__(self):
+		values = self.load()
+		for x,y in np.argwhere(~np.isnan(values[:,:,0,0])):
+			yield (int(x),int(y))
+
+	def __len__(self):
+		return int(np.count_nonzero(~np.isnan(self.load()[:,:,0,0])))
+
+def isUpToDate(layout,fname,engine):
+	if not os.path.exists(fname) or os.path.getmtime(fname) < os.path.getmtime(layout):
+		return False
+	with np.load(fname) as data:
+		return 'engine' in data and str(data['engine']) == engine
+
+def getAdviceTable(layout,engine = NATIVE_ENGINE,recompute = False):
+	# computes and saves the table of layout if needed, returns it as a lazy dict
+	fname = adviceTableFile(layout)
+	if recompute or not isUpToDate(layout,fname,engine):
+		walls,holes,targets,position = gridsFromFile(layout)
+		saveAdviceArray(createAdviceArray(walls,holes,targets,engine),fname,engine)
+	return AdviceTable(fname)
+
+if __name__ == "__main__":
+	engine = sys.argv[1] if len(sys.argv) > 1 else NATIVE_ENGINE
+	for layout in sorted(glob.glob("layout/*.lay")):
+		table = getAdviceTable(layout,engine)
+		print(layout, adviceTableFile(layout), len(table))
@@ -0,0 +1,234 @@
+# frozenLakeBenchmark.py
+
+# Benchmarks of the analysis pipeline.
+#
+# benchmarkStormOptions times each StormOptions over a set of layouts and measures how far its
+# values are from a reference computed by policy iteration with a small precision, so that the
+# fastest settings within an accuracy bound can be chosen for the batch runs.
+#
+# benchmarkScaling runs the pipeline of ConditionalMinDistSession on seeded layouts of growing
+# size, hole density and number of targets, and records the time of each phase, the size of
+# the models and the peak RSS, so that the hot phases and the regressions show before a change ships.
+
+import os, sys, glob, time, math, json, random, resource, argparse, multiprocessing, functools
+import stormpy
+
+from frozenLake import gridsFromFile, createWalls, addOther
+from frozenLakeStorm import createPrismProgramFromGrids, prismStrFromGrids, compactPrismStrFromGrids, parsePrismStr, getValue, StormOptions, PRISM_BUILDER, SPARSE_BUILDER, COMPACT_BUILDER, TEMPLATE_BUILDER, PRUNED_BUILDER, createPrismProgramFromTemplate, createModelFromGrids
+from conditionalMinDist import ConditionalMinDistSession, ConditionalMinDistEngine, parseProperties, modelChecking
+
+CANDIDATE_OPTIONS = [
+	StormOptions(),
+	StormOptions('vi'),
+	StormOptions('vi', 1e-8),
+	StormOptions('pi'),
+	StormOptions('topological'),
+	StormOptions('ii'),
+	StormOptions('svi'),
+	StormOptions('ovi'),
+	StormOptions(engine='hybrid'),
+	StormOptions(engine='dd'),
+]
+REFERENCE_OPTIONS = StormOptions('pi', 1e-12)
+
+def layoutValues(prismFile, options):
+	# probability, distance and storm distance; only the probability with the symbolic engines
+	if options.engine != 'sparse':
+		return getValue(prismFile, options=options), None, None
+	with ConditionalMinDistSession(prismFile, options=options) as session:
+		return session.getFinalValues()
+
+def relativeDeviation(value, reference):
+	if math.isinf(value) or math.isinf(reference):
+		return 0.0 if value == reference else math.inf
+	return abs(value-reference)/max(1.0, abs(reference))
+
+def benchmarkStormOptions(layouts, candidates = CANDIDATE_OPTIONS, reference = REFERENCE_OPTIONS):
+	"""
+	Returns one dict per candidate: total time over layouts, and maximal relative deviation
+	from reference of the probability, the distance and the storm distance (None when not computed).
+	The storm distance also depends on how the solver breaks ties between optimal actions.
+	"""
+	rows = [{"options": str(options), "time": 0.0, "probability": 0.0, "distance": 0.0, "storm distance": 0.0, "failures": 0} for options in candidates]
+	for layout in layouts:
+		prismFile = createPrismProgramFromGrids(*gridsFromFile(layout),0)
+		referenceValues = layoutValues(prismFile, reference)
+		for options,row in zip(candidates,rows):
+			t0 = time.time()
+			try:
+				values = layoutValues(prismFile, options)
+			except Exception as error:
+				print(f"{options} failed on {layout}: {error}", file = sys.stderr)
+				row["failures"] += 1
+				continue
+			row["time"] += time.time()-t0
+			for name,value,referenceValue in zip(["probability","distance","storm distance"],values,referenceValues):
+				if value is None:
+					row[name] = None
+				elif row[name] is not None:
+					row[name] = max(row[name], relativeDeviation(value, referenceValue))
+	return rows
+
+def printOptionsTable(rows, file = sys.stdout):
+	print(f"{'options':<48} {'time':>9} {'probability':>12} {'distance':>12} {'storm dist':>12} {'failures':>8}", file = file)
+	for row in rows:
+		deviations = ["-" if row[name] is None else f"{row[name]:.2e}" for name in ["probability","distance","storm distance"]]
+		print(f"{row['options']:<48} {row['time']:>9.3f} {deviations[0]:>12} {deviations[1]:>12} {deviations[2]:>12} {row['failures']:>8}", file = file)
+
+def fastestWithin(rows, bound):
+	# fastest options whose probability and distance deviations are within bound
+	accepted = [row for row in rows if row["failures"] == 0 and row["probability"] <= bound and (row["distance"] is None or row["distance"] <= bound)]
+	if accepted == []:
+		return None
+	return min(accepted, key = lambda row: row["time"])
+
+# scaling of the PRISM -> storm -> conditional distance pipeline
+
+SCALING_SIZES = [10, 20, 50, 100, 200, 300] # the default COMPACT_BUILDER handles all of them, PRISM_BUILDER fails from about 80x80
+SCALING_PS = [0.9, 0.8]
+SCALING_TARGETS = [1, 4]
+PHASES = ["emission", "parse", "build", "Pmax", "removeBadStates", "removeBadStatesKeepActions", "Tmin", "apply_scheduler"]
+
+def scalingLayout(size, p, numTargets, seed):
+	# seeded square layout of createWalls and addOther, with numTargets-1 more targets on free cells
+	state = random.getstate()
+	random.seed(f"{seed}_{size}_{p}_{numTargets}")
+	walls = createWalls(size,size,p=p)
+	walls,holes,targets,position = addOther(walls,p=p)
+	free = [(i,j) for i in range(size) for j in range(size) if not walls[i][j] and not holes[i][j] and not targets[i][j] and (i,j) != position]
+	for i,j in random.sample(free, min(numTargets-1, len(free))):
+		targets[i][j] = True
+	random.setstate(state)
+	return walls,holes,targets,position
+
+def modelSizes(model):
+	return {"states": model.nr_states, "choices": model.nr_choices, "transitions": model.nr_transitions}
+
+def timePipeline(walls,holes,targets,position,formula1 = "Pmax=? [F win]",formula2 = "Tmin=? [F win]",options = None,builder = PRISM_BUILDER):
+	# the steps of ConditionalMinDistSession.getFinalValues, timed one by one; emission and parse are skipped by the sparse builder
+	times = {}
+	t0 = time.perf_counter()
+	def lap(phase):
+		nonlocal t0
+		t1 = time.perf_counter()
+		times[phase] = t1-t0
+		t0 = t1
+
+	if builder in [SPARSE_BUILDER, PRUNED_BUILDER]: # no PRISM text: the model is built from the grids
+		engine = ConditionalMinDistEngine(createModelFromGrids(walls,holes,targets,position,0,builder),options=options)
+		lap("build")
+		engine.model = engine.builtModel
+		properties = parseProperties(formula1)
+	elif builder == TEMPLATE_BUILDER: # no emission: the constants of the parsed template are defined
+		engine = ConditionalMinDistEngine(createPrismProgramFromTemplate(walls,holes,targets,position),options=options)
+		lap("parse")
+		properties = parseProperties(formula1, engine.prismProgram)
+		builderOptions = stormpy.BuilderOptions([p.raw_formula for p in properties])
+		builderOptions.set_build_state_valuations()
+		engine.model = stormpy.build_sparse_model_with_options(engine.prismProgram, builderOptions)
+		lap("build")
+	else:
+		text = (compactPrismStrFromGrids if builder == COMPACT_BUILDER else prismStrFromGrids)(walls,holes,targets,position)
+		lap("emission")
+		engine = ConditionalMinDistEngine(parsePrismStr(text),options=options)
+		lap("parse")
+		properties = parseProperties(formula1, engine.prismProgram)
+		builderOptions = stormpy.BuilderOptions([p.raw_formula for p in properties])
+		builderOptions.set_build_state_valuations()
+		engine.model = stormpy.build_sparse_model_with_options(engine.prismProgram, builderOptions) # as in engine.getValue
+		lap("build")
+	engine.result = modelChecking(engine.model, properties[0], options, extract_scheduler=True)
+	lap("Pmax")
+	engine.removeBadStates()
+	lap("removeBadStates")
+	engine.removeBadStatesKeepActions()
+	lap("removeBadStatesKeepActions")
+	engine.getBestDistValue(formula2)
+	lap("Tmin")
+	dtmc = engine.newModelConditional.apply_scheduler(engine.result.scheduler, drop_unreachable_states=False)
+	lap("apply_scheduler")
+
+	initialState = engine.model.initial_states[0]
+	return {
+		"times": times,
+		"model": modelSizes(engine.model),
+		"conditioned model": modelSizes(engine.newModel),
+		"dtmc": modelSizes(dtmc),
+		"probability": engine.result.at(initialState),
+		"distance": engine.newResult.at(initialState),
+	}
+
+def scalingRun(size, p, numTargets, seed, options = None, builder = COMPACT_BUILDER):
+	# one layout; run in its own process so that the peak RSS is the one of this layout
+	row = {"size": size, "p": p, "targets": numTargets, "seed": seed, "builder": builder, "error": None}
+	try:
+		walls,holes,targets,position = scalingLayout(size,p,numTargets,seed)
+		row["cells"] = sum(not wall for wallRow in walls for wall in wallRow)
+		row.update(timePipeline(walls,holes,targets,position,options=options,builder=builder))
+	except Exception as error:
+		row["error"] = f"{type(error).__name__}: {error}"[:200] # storm puts whole expressions in its messages
+	row["peak rss MB"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024 # KB on linux
+	return row
+
+def benchmarkScaling(sizes = SCALING_SIZES, ps = SCALING_PS, targetCounts = SCALING_TARGETS, seed = 0, options = None, builder = COMPACT_BUILDER):
+	"""
+	Returns one dict per (size, p, number of targets): the time of each phase in PHASES, the number
+	of states, choices and transitions of the model, of the conditioned model and of the dtmc,
+	the values at the initial position and the peak RSS. A failed layout only has an error.
+	Each layout runs in a fresh process; the rows are printed to stderr as they come.
+	"""
+	configs = [(size,p,numTargets) for size in sizes for p in ps for numTargets in targetCounts]
+	rows = []
+	pool = multiprocessing.Pool(1, maxtasksperchild=1)
+	try:
+		for row in pool.imap(functools.partial(scalingRunConfig, seed=seed, options=options, builder=builder), configs):
+			rows.append(row)
+			printScalingRow(row, file = sys.stderr)
+		pool.close() # not terminate, the last worker writes its instrumentation records when it exits
+		pool.join()
+	except BaseException:
+		pool.terminate()
+		raise
+	return rows
+
+def scalingRunConfig(config, seed, options, builder):
+	return scalingRun(*config, seed, options, builder)
+
+def printScalingRow(row, file = sys.stdout):
+	name = f"{row['size']}x{row['size']} p={row['p']} t={row['targets']}"
+	if row["error"] is not None:
+		print(f"{name:<22} failed: {row['error']}", file = file)
+		return
+	times = row["times"]
+	hottest = max(times, key = lambda phase: times[phase])
+	print(f"{name:<22} {row['model']['states']:>8} {row['model']['choices']:>8} {row['model']['transitions']:>9} " + " ".join(f"{times[phase]:>9.3f}" if phase in times else f"{'-':>9}" for phase in PHASES) + f" {sum(times.values()):>9.3f} {row['peak rss MB']:>8.0f} {hottest}", file = file)
+
+def printScalingTable(rows, file = sys.stdout):
+	print(f"{'layout':<22} {'states':>8} {'choices':>8} {'trans':>9} " + " ".join(f"{phase[:9]:>9}" for phase in PHASES) + f" {'total':>9} {'rss MB':>8} hottest", file = file)
+	for row in rows:
+		printScalingRow(row, file = file)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Benchmarks of the analysis pipeline")
+	subparsers = parser.add_subparsers(dest="benchmark", required=True)
+	optionsParser = subparsers.add_parser("options", help="time and accuracy of the storm solver options")
+	optionsParser.add_argument("--layouts", default="layout/*.lay")
+	optionsParser.add_argument("--bound", type=float, default=1e-4, help="accepted relative deviation of the probability and the distance")
+	scalingParser = subparsers.add_parser("scaling", help="time of each phase of the pipeline on growing layouts")
+	scalingParser.add_argument("--sizes", type=int, nargs="+", default=SCALING_SIZES, help="number of cells per side")
+	scalingParser.add_argument("--p", type=float, nargs="+", default=SCALING_PS, help="p of createWalls and addOther, bigger is fewer walls and holes")
+	scalingParser.add_argument("--targets", type=int, nargs="+", default=SCALING_TARGETS)
+	scalingParser.add_argument("--seed", type=int, default=0)
+	scalingParser.add_argument("--builder", choices=[PRISM_BUILDER, COMPACT_BUILDER, TEMPLATE_BUILDER, SPARSE_BUILDER, PRUNED_BUILDER], default=COMPACT_BUILDER, help="the PRISM builder fails from about 80x80")
+	scalingParser.add_argument("--output", default="scaling.json")
+	args = parser.parse_args()
+	if args.benchmark == "options":
+		rows = benchmarkStormOptions(sorted(glob.glob(args.layouts)))
+		printOptionsTable(rows)
+		best = fastestWithin(rows, args.bound)
+		print(f"fastest within {args.bound}: {best['options'] if best is not None else 'none'}")
+	else:
+		rows = benchmarkScaling(args.sizes, args.p, args.targets, args.seed, builder=args.builder)
+		with open(args.output, "w") as f:
+			json.dump(rows, f, indent=1)
+		printScalingTable(rows)
@@ -10,11 +10,12 @@
 # .                   .     .
 # (X-1,0) (X-1,1)...(X-1,Y-1)
 
-import random, time, curses, os, sys
+import random, time, curses, os, sys, bisect, itertools, collections
 import numpy as np
 from tensorflow import keras
 from typing import TypeVar, Type, Any, Optional, Sequence, List, Tuple, Dict, Union, Generic, NoReturn
 from frozenLakeStorm import *
+from frozenLakeNative import IncrementalAnalysis, applyCellEdits, WALL, HOLE, TARGET, EMPTY
 
 # CURRENTPWD = os.path.dirname(os.path.abspath(__file__))
 # sys.path.append(os.path.join(CURRENTPWD, '../src'))
@@ -49,20 +50,37 @@ class MDPPredicate(MDPPredicateInterface):
 		name=s
 		return cls(name)
 
+POSITION_BITS = 16 # a position (x,y) is encoded as the int x << POSITION_BITS | y
+POSITION_MASK = (1 << POSITION_BITS)-1
+
 class MDPState(MDPStateInterface):
+	__slots__ = ["code"]
+
 	# methods that must be redefined
 	def __init__(self,position: Position) -> None:
-		self.position=position # a pair (x,y) of integers
+		self.code = (position[0] << POSITION_BITS) | position[1]
+	@property
+	def position(self) -> Position: # a pair (x,y) of integers
+		return (self.code >> POSITION_BITS, self.code & POSITION_MASK)
+	@position.setter
+	def position(self, position: Position) -> None:
+		self.code = (position[0] << POSITION_BITS) | position[1]
 	def deepCopy(self) -> "MDPState":
-		return MDPState(self.position)
+		mdpState = MDPState.__new__(MDPState)
+		mdpState.code = self.code
+		return mdpState
 	def initFromCopy(self, other: "MDPState") -> None:
-		self.position = other.position
+		self.code = other.code
 	def __str__(self) -> str:
 		return "(position:"+str(self.position)+")"
+	def key(self) -> int: # hashable key of the state, the same for every path that reaches the position
+		return self.code
+	def __hash__(self) -> int:
+		return self.code
 	def __eq__(self, other: object) -> bool:
 		if not isinstance(other, MDPState):
 			return NotImplemented
-		return (self.position == other.position)
+		return (self.code == other.code)
 
 	# methods that can be redefined
 	def consoleStr(self) -> str:
@@ -79,7 +97,9 @@ class MDPState(MDPStateInterface):
 		return cls(position)
 
 class MDPAction(MDPActionInterface):
-	# Immutable class
+	# the actions without infoStr returned by MDPOperations are shared and read only (see internedAction), deepCopy them to change them
+	__slots__ = ["action","infoStr"]
+
 	# methods that must be redefined
 	def __init__(self,action: str,infoStr: str) -> None:
 		self.action=action
@@ -117,7 +137,9 @@ class MDPAction(MDPActionInterface):
 
 
 class MDPStochasticAction(MDPStochasticActionInterface):
-	# Immutable class
+	# the actions without infoStr returned by MDPOperations are shared and read only (see internedStochasticAction), deepCopy them to change them
+	__slots__ = ["action","infoStr"]
+
 	# methods that must be redefined
 	def __init__(self,action: str,infoStr: str) -> None:
 		self.action=action
@@ -153,10 +175,48 @@ class MDPStochasticAction(MDPStochasticActionInterface):
 			infoStr+=splits[i]
 		return cls(action,infoStr)
 
+MOVES = ['North','South','West','East','Stop'] # order of getLegalActions and getLegalStochasticActions, then Stop
+MOVE_INDEX = {move: i for i,move in enumerate(MOVES)}
+MOVE_OFFSETS = [(-1,0),(1,0),(0,-1),(0,1)]
+REVERSE_MOVES = [1,0,3,2,-1]
+MOVE_CODES = {'North': -(1 << POSITION_BITS), 'South': 1 << POSITION_BITS, 'West': -1, 'East': 1, 'Stop': 0} # change of MDPState.code
+
+class InternedMDPAction(MDPAction):
+	# shared instance, writing infoStr would change it for every game
+	__slots__ = []
+	def __init__(self,action: str) -> None:
+		object.__setattr__(self,"action",action)
+		object.__setattr__(self,"infoStr","")
+	def __setattr__(self, name: str, value: Any) -> None:
+		raise Exception(f"interned action {self.action} is read only, use deepCopy")
+	def __reduce__(self) -> Any: # unpickled as the shared instance
+		return (internedAction, (self.action,))
+
+class InternedMDPStochasticAction(MDPStochasticAction):
+	__slots__ = []
+	def __init__(self,action: str) -> None:
+		object.__setattr__(self,"action",action)
+		object.__setattr__(self,"infoStr","")
+	def __setattr__(self, name: str, value: Any) -> None:
+		raise Exception(f"interned stochastic action {self.action} is read only, use deepCopy")
+	def __reduce__(self) -> Any:
+		return (internedStochasticAction, (self.action,))
+
+INTERNED_ACTIONS = {label: InternedMDPAction(label) for label in MOVES}
+INTERNED_STOCHASTIC_ACTIONS = {label: InternedMDPStochasticAction(label) for label in MOVES}
+
+def internedAction(label: str) -> MDPAction: # the shared MDPAction of label, without infoStr
+	return INTERNED_ACTIONS[label]
+
+def internedStochasticAction(label: str) -> MDPStochasticAction:
+	return INTERNED_STOCHASTIC_ACTIONS[label]
+
 Grid = List[List[bool]]
 GridDistance = List[List[int]]
 
 def gridCopy(grid: Grid) -> Grid:
+	if isinstance(grid, np.ndarray):
+		return grid.copy()
 	return [[grid[i][j] for j in range(len(grid[i]))] for i in range(len(grid))]
 
 def gridStr(grid: Grid) -> str:
@@ -275,37 +335,92 @@ class MDPOperations(MDPOperationsInterface[MDPPredicate, MDPState, MDPAction, MD
 
 	# methods that must be redefined
 	def __init__(self, walls: Grid, holes: Grid, targets: Grid, drawHorizon: int, discountFactor: float) -> None:
-		self.walls=walls
-		self.holes=holes
-		self.targets=targets
+		# the grids are kept in a single (3, height, width) np.bool_ array, walls, holes and targets are views of it.
+		# They are read only: the tables below are computed from them once, withEdits gives the MDPOperations of an edited layout
+		self.grids = gridsToBoolArray(walls,holes,targets)
+		self.grids.setflags(write=False)
+		self.walls,self.holes,self.targets = self.grids
 		self.drawHorizon=drawHorizon
 		self.discountFactor=discountFactor
-
-		self.targetList=[]
-		self.holeList=[]
-		for i in range(len(targets)):
-			for j in range(len(targets[i])):
-				if targets[i][j]:
-					self.targetList.append((i,j))
-		for i in range(len(holes)):
-			for j in range(len(holes[i])):
-				if holes[i][j]:
-					self.holeList.append((i,j))
+		X,Y = self.walls.shape
+		self.width = Y
+		self.layoutKey = (self.grids.shape, self.grids.tobytes()) # equal for the MDPOperations of the same layout
+
+		# cells where an execution ends: win, loss, or no legal action
+		free = ~self.walls
+		hasMove = np.zeros((X,Y), dtype=np.bool_)
+		hasMove[1:,:] |= free[:-1,:]
+		hasMove[:-1,:] |= free[1:,:]
+		hasMove[:,1:] |= free[:,:-1]
+		hasMove[:,:-1] |= free[:,1:]
+		self.terminal = self.holes | self.targets | ~hasMove
+
+		# transition tables, cells are numbered x*Y+y and moves follow MOVES
+		cellIndex = np.arange(X*Y).reshape((X,Y))
+		self.successors = np.full((X,Y,4), -1, dtype=np.int64) # cell reached by each move, -1 for walls and borders
+		for d,(dx,dy) in enumerate(MOVE_OFFSETS):
+			neighbours = (slice(max(0,dx),X-max(0,-dx)), slice(max(0,dy),Y-max(0,-dy)))
+			self.successors[max(0,-dx):X-max(0,dx), max(0,-dy):Y-max(0,dy), d] = np.where(free[neighbours], cellIndex[neighbours], -1)
+		self.legalMask = self.successors >= 0 # legal actions, and moves that a slip can take
+		weights = np.zeros((X,Y,len(MOVES),4))
+		for a in range(len(MOVES)):
+			for d in range(4):
+				if d != REVERSE_MOVES[a]:
+					weights[:,:,a,d] = np.where(self.legalMask[:,:,d], INTENDED_WEIGHT if d == a else SLIP_WEIGHT, 0.0)
+		total = weights.sum(axis=3, keepdims=True)
+		self.slipDistribution = np.divide(weights, total, out=np.zeros_like(weights), where=total > 0) # probability of each move when playing an action
+		self.legalLabels = [tuple([MOVES[d] for d in range(4) if legal[d]]) for legal in self.legalMask.reshape((X*Y,4)).tolist()]
+		self.legalActions = [tuple([INTERNED_ACTIONS[label] for label in labels]) for labels in self.legalLabels]
+		self.slipTable = {} # (stochastic actions, probabilities, cumulative probabilities) of a cell and action, filled on first use
+		self.terminalCells = self.terminal.ravel().tolist()
+
+		self.targetList=[(int(i),int(j)) for i,j in np.argwhere(self.targets)]
+		self.holeList=[(int(i),int(j)) for i,j in np.argwhere(self.holes)]
+		walls,holes,targets = self.grids.tolist() # faster to index in the loops of gridDistance
 		self.holeDistance,self.maxHoleDistance = gridDistance(walls,targets,self.holeList)
 		self.targetDistance,self.maxTargetDistance = gridDistance(walls,holes,self.targetList)
-		pArray = np.zeros((1,len(walls),len(walls[0])))
-		holeDistanceTable = np.zeros((1,len(walls),len(walls[0])))
-		for i in range(len(walls)):
-			for j in range(len(walls[0])):
-				holeDistanceTable[0][i][j] = normalizeDistance(self.holeDistance[i][j],self.maxHoleDistance)
-		targetDistanceTable = np.zeros((1,len(walls),len(walls[0])))
-		for i in range(len(walls)):
-			for j in range(len(walls[0])):
-				targetDistanceTable[0][i][j] = normalizeDistance(self.targetDistance[i][j],self.maxTargetDistance)
-		self.config = np.concatenate((gridToArray(walls),gridToArray(holes),gridToArray(targets),pArray,holeDistanceTable,targetDistanceTable),axis=0)
+		# walls, holes, targets, position, and the normalized distances to holes and to targets, the input of the networks.
+		# The first planes are a float copy of the grids: numpy cannot view a bool array as floats
+		self.config = np.zeros((6,X,Y))
+		self.config[0:3] = self.grids
+		self.config[4] = normalizeDistanceArray(np.array(self.holeDistance),self.maxHoleDistance)
+		self.config[5] = normalizeDistanceArray(np.array(self.targetDistance),self.maxTargetDistance)
+		self.config.setflags(write=False)
+		self.stormOracle = None
+		self.nativeAnalysis = None
+		self.scoreGrids = {} # score class -> score grids of MDPStateScoreGrid
 
 	def deepCopy(self) -> "MDPOperations":
-		return MDPOperations(gridCopy(self.walls),gridCopy(self.holes),gridCopy(self.targets),self.drawHorizon,self.discountFactor)
+		grids = self.grids.copy()
+		return MDPOperations(grids[0],grids[1],grids[2],self.drawHorizon,self.discountFactor) # the caches are not shared
+
+	def getNativeAnalysis(self) -> IncrementalAnalysis:
+		# values of every cell from the numpy engine, solved once per layout
+		if self.nativeAnalysis is None:
+			self.nativeAnalysis = IncrementalAnalysis(self.walls,self.holes,self.targets)
+		return self.nativeAnalysis
+
+	def withEdits(self, edits) -> "MDPOperations":
+		"""
+		MDPOperations of the layout where each (position, cell type) of edits is applied,
+		cell types are WALL, HOLE, TARGET and EMPTY of frozenLakeNative.
+		The values of the native analysis, if any, are updated instead of solved again.
+		"""
+		walls,holes,targets = applyCellEdits(self.walls,self.holes,self.targets,edits)
+		mdpOperations = MDPOperations(walls,holes,targets,self.drawHorizon,self.discountFactor)
+		if self.nativeAnalysis is not None:
+			mdpOperations.nativeAnalysis = self.nativeAnalysis.edited(edits)
+		return mdpOperations
+
+	def getStormOracle(self, builder = PRISM_BUILDER) -> StormOracle:
+		# solved once per layout, the grids cannot change (see withEdits)
+		if self.stormOracle is None:
+			self.stormOracle = StormOracle(self.walls,self.holes,self.targets,builder)
+		return self.stormOracle
+
+	def resetStormOracle(self) -> None:
+		self.stormOracle = None
+
 	def __str__(self) -> str:
 		return "(walls:\n"+gridStr(self.walls)+",holes:\n"+gridStr(self.holes)+",targets:\n"+gridStr(self.targets)+",discountFactor:"+str(self.discountFactor)+")"
 
@@ -315,65 +430,53 @@ class MDPOperations(MDPOperationsInterface[MDPPredicate, MDPState, MDPAction, MD
 		config[3][position[0]][position[1]] = 1
 		return(config)
 
+	def getCell(self, mdpState: MDPState) -> int: # x*Y+y, the index of the position of mdpState in the tables
+		code = mdpState.code
+		return (code >> POSITION_BITS)*self.width + (code & POSITION_MASK)
+
+	def getSlips(self, cell: int, action: str):
+		# stochastic actions, probabilities and cumulative probabilities of the moves of action from cell
+		key = cell*len(MOVES)+MOVE_INDEX[action]
+		slips = self.slipTable.get(key)
+		if slips is None:
+			row = self.slipDistribution[cell // self.width, cell % self.width, MOVE_INDEX[action]].tolist()
+			probabilities = [p for p in row if p > 0]
+			slips = (tuple([INTERNED_STOCHASTIC_ACTIONS[MOVES[d]] for d in range(4) if row[d] > 0]), probabilities, list(itertools.accumulate(probabilities)))
+			self.slipTable[key] = slips
+		return slips
+
 	def applyTransitionOnState(self, mdpState: MDPState, mdpTransition: MDPTransition[MDPAction, MDPStochasticAction]) -> float:
-		if not isLegalAction(mdpState.position,mdpTransition.mdpAction.action,self.walls):
+		action = mdpTransition.mdpAction.action
+		if action not in self.legalLabels[self.getCell(mdpState)] and action != 'Stop':
 			raise Exception("illegal action played with "+str(mdpTransition)+" from "+str(mdpState))
-		newPos=getNextPosition(mdpState.position,mdpTransition.mdpStochasticAction.action)
-		mdpState.position=newPos
+		mdpState.code += MOVE_CODES[mdpTransition.mdpStochasticAction.action]
 		mdpReward=-1
 		return mdpReward
-	def getStochasticActions(self, mdpState: MDPState, mdpAction: MDPAction, quietInfoStr: bool) -> MDPStochasticAction:
-		mdpStochasticActions = [MDPStochasticAction(label,"") for label in getLegalStochasticActions(mdpState.position,self.walls,mdpAction.action)]
-		# print("trying to play",mdpAction,"returns"," ".join([a.action for a in mdpStochasticActions]))
-		return mdpStochasticActions
+	def getStochasticActions(self, mdpState: MDPState, mdpAction: MDPAction, quietInfoStr: bool = True) -> MDPStochasticAction:
+		return list(self.getSlips(self.getCell(mdpState),mdpAction.action)[0])
 
 	def getDistribution(self, mdpState: MDPState, mdpAction: MDPAction):
-		mdpStochasticActions = [MDPStochasticAction(label,"") for label in getLegalStochasticActions(mdpState.position,self.walls,mdpAction.action)]
-		# print("trying to play",mdpAction,"returns"," ".join([a.action for a in mdpStochasticActions]))
+		mdpStochasticActions,probabilities,cumulative = self.getSlips(self.getCell(mdpState),mdpAction.action)
 		dist: util.ConsoleStrFloatCounter[MDPStochasticAction] = util.ConsoleStrFloatCounter()
-		for a in mdpStochasticActions:
-			if a.action == mdpAction.action:
-				dist[a] = 10.0
-			else:
-				dist[a] = 1.0
-		dist.normalize()
+		for a,probability in zip(mdpStochasticActions,probabilities):
+			dist[a] = probability
 		return dist
 
 	def drawStochasticAction(self, mdpState: MDPState, mdpAction: MDPAction, quietInfoStr: bool) -> MDPStochasticAction:
-		mdpStochasticActions = [MDPStochasticAction(label,"") for label in getLegalStochasticActions(mdpState.position,self.walls,mdpAction.action)]
-		# print("trying to play",mdpAction,"returns"," ".join([a.action for a in mdpStochasticActions]))
-		dist: util.ConsoleStrFloatCounter[MDPStochasticAction] = util.ConsoleStrFloatCounter()
-		for a in mdpStochasticActions:
-			if a.action == mdpAction.action:
-				dist[a] = 10.0
-			else:
-				dist[a] = 1.0
-		dist.normalize()
-		if len(dist) == 0:
+		mdpStochasticActions,probabilities,cumulative = self.getSlips(self.getCell(mdpState),mdpAction.action)
+		if len(mdpStochasticActions) == 0:
 			# return None
 			raise Exception("empty distribution")
-		choice = util.chooseFromDistribution( dist ).deepCopy()
-		if not quietInfoStr:
-			isUniversal = True
-			vv = None
-			for k,v in dist.items():
-				if vv is None : vv = v
-				if v != vv: isUniversal = False
-			if isUniversal:
-				if choice.infoStr != '':
-					choice.infoStr += '#'
-				choice.infoStr += 'DistUniversal'
+		i = bisect.bisect_left(cumulative, random.random()) # first move whose cumulative probability reaches the draw, as util.chooseFromDistribution
+		choice = mdpStochasticActions[min(i,len(mdpStochasticActions)-1)]
+		if not quietInfoStr: # the shared actions are not modified
+			if min(probabilities) == max(probabilities):
+				choice = MDPStochasticAction(choice.action,'DistUniversal')
 			else:
-				# pass
-				if choice.infoStr != '':
-					choice.infoStr += '#'
-				choice.infoStr += 'Dist'+str(dist)
+				choice = MDPStochasticAction(choice.action,'Dist'+str(self.getDistribution(mdpState,mdpAction)))
 		return choice
 	def getLegalActions(self, mdpState: MDPState) -> List[MDPAction]:
-		legalActions=[]
-		for label in getLegalActions(mdpState.position,self.walls):
-			legalActions.append(MDPAction(label,""))
-		return legalActions
+		return list(self.legalActions[self.getCell(mdpState)])
 
 	# methods that can be redefined
 	def consoleStr(self) -> str:
@@ -387,10 +490,12 @@ class MDPOperations(MDPOperationsInterface[MDPPredicate, MDPState, MDPAction, MD
 		return mdpPredicates
 	def getPredicates(self, mdpState: MDPState) -> List[MDPPredicate]:
 		mdpPredicates: List[MDPPredicate] = []
+		if not self.terminalCells[self.getCell(mdpState)]:
+			return mdpPredicates
 		x,y = mdpState.position
-		if self.holes[x][y]:
+		if self.holes[x,y]:
 			mdpPredicates.append(MDPPredicate("Loss"))
-		if self.targets[x][y]:
+		if self.targets[x,y]:
 			mdpPredicates.append(MDPPredicate("Win"))
 		# mdpPredicates.append(MDPPredicate(fileStrPos((x,y))))
 		# list all predicates that hold on mdpState
@@ -398,8 +503,7 @@ class MDPOperations(MDPOperationsInterface[MDPPredicate, MDPState, MDPAction, MD
 		return mdpPredicates
 	def isExecutionTerminal(self, mdpExecution: MDPExecution[MDPPredicate, MDPState, MDPAction, MDPStochasticAction]) -> bool:
 		# Redefine this method if you want a notion of terminal state/path
-		x,y = mdpExecution.mdpEndState.position
-		if self.holes[x][y] or self.targets[x][y] or self.getLegalActions(mdpExecution.mdpEndState) == []:# or mdpExecution.length() == self.drawHorizon
+		if self.terminalCells[self.getCell(mdpExecution.mdpEndState)]:# or mdpExecution.length() == self.drawHorizon
 			return True
 		# is the execution over? (terminal state reached, horizon reached, etc)
 		return False
@@ -408,9 +512,9 @@ class MDPOperations(MDPOperationsInterface[MDPPredicate, MDPState, MDPAction, MD
 		# penalty for losing for exemple
 		mdpTerminalReward=0.0
 		x,y = mdpExecution.mdpEndState.position
-		if self.targets[x][y]:
+		if self.targets[x,y]:
 			mdpTerminalReward=100.0
-		elif self.holes[x][y] or self.getLegalActions(mdpExecution.mdpEndState) == []:
+		elif self.terminal[x,y]:
 			mdpTerminalReward=-100.0
 		# elif mdpExecution.length() == self.drawHorizon:
 		# 	mdpTerminalReward=0
@@ -581,22 +685,6 @@ def readFromFile(fname):
 	initState = MDPState.fromFileStr(s0[1])
 	return mdp,initState,initPredicates
 
-def gridsFromFile(fname):
-	f = open(fname)
-	FILE_SEPARATOR="\nInitPredicates\n"
-	s = f.read().split(FILE_SEPARATOR)[0]
-	FILE_SEPARATOR="\nInitPosition\n"
-	s = s.split(FILE_SEPARATOR)
-	f.close()
-	mdpDescription = s[0]
-	position = posFromFileStr(s[1])
-	FILE_SEPARATOR="\nParameters\n"
-	mdpDescription = mdpDescription.split(FILE_SEPARATOR)
-	walls=wallsFromStr(mdpDescription[0])
-	holes=holesFromStr(mdpDescription[0])
-	targets=targetsFromStr(mdpDescription[0])
-	return (walls, holes, targets, position)
-
 def mdpFromGrids(walls, holes, targets, position):
 	mdp = MDPOperations(walls= walls, holes = holes, targets = targets, drawHorizon = 1000, discountFactor = 1)
 	initState = MDPState(position = position)
@@ -609,8 +697,12 @@ def runGames(**kwargs):
 	mdp, initState, initPredicates = readFromFile(layout)
 	isReplay = kwargs['replay']
 	kwargs.pop('replay')
+	scoreCacheSize = kwargs.pop('scoreCacheSize', 0) # cached scores of the positions, 0 to disable
 	if kwargs['useMCTS']:
 		kwargs.pop('useMCTS')
+		mdpStateScore = kwargs.get('mdpStateScore')
+		if scoreCacheSize > 0 and mdpStateScore is not None and not isinstance(mdpStateScore, MDPStateScoreGrid): # grid scores are already a lookup
+			kwargs['mdpStateScore'] = MDPStateScoreCached(mdpStateScore, MDPScoreCache(scoreCacheSize))
 		kwargs.pop('useDT')
 		kwargs.pop('useNN')
 		kwargs.pop('useMultiNN')
@@ -668,75 +760,65 @@ def runGames(**kwargs):
 		runResults(engineList,quiet=True,prettyConsole=True)
 	return results
 
-class MDPStateScoreSimple(MDPStateScoreInterface):
+class MDPStateScoreGrid(MDPStateScoreInterface):
 	"""
-	Score using Manhattan distance
+	Score that only depends on the position. The scores of all the cells are computed once per layout
+	by buildScoreGrid, kept as a float32 grid in mdpOperations.scoreGrids, and getScore is a lookup.
 	"""
-	def getScore(self, executionEngine):
-		position = executionEngine.mdpEndState().position
-		walls = executionEngine.mdpOperations.walls
-		holes = executionEngine.mdpOperations.holes
-		targets = executionEngine.mdpOperations.targets
-		score = 0
-		for i in range(len(targets)):
-			for j in range(len(targets[i])):
-				if targets[i][j]:
-					posT=(i,j)
-					d = distanceM(position,posT)
-					score += d
-		for i in range(len(holes)):
-			for j in range(len(holes[i])):
-				if holes[i][j]:
-					posT=(i,j)
-					d = distanceM(position,posT)
-					if d==0:
-						score += 10
-		return -score
+	def buildScoreGrid(self, mdpOperations):
+		raise Exception("buildScoreGrid not implemented")
+
+	def scoreGrid(self, mdpOperations): # the float32 grid, and its cells as a list of floats indexed by getCell
+		grids = mdpOperations.scoreGrids.get(type(self))
+		if grids is None:
+			grid = np.ascontiguousarray(self.buildScoreGrid(mdpOperations), dtype=np.float32)
+			grids = (grid, grid.ravel().tolist())
+			mdpOperations.scoreGrids[type(self)] = grids
+		return grids
 
-class MDPStateScoreFast(MDPStateScoreInterface):
 	def getScore(self, executionEngine):
-		position = executionEngine.mdpEndState().position
-		scoreTbl = [0.0,0.0,0.0,0.0]
-		score = 0.0
-		X=len(executionEngine.mdpOperations.walls)
-		Y=len(executionEngine.mdpOperations.walls[0])
-		dm=X+Y+1
-		dM=0
-		for posT in executionEngine.mdpOperations.targetList:
-			d = distanceM(position,posT)
-			if d>dM:
-				dM=d
-			if d<dm:
-				dm=d
-		if dm == 0:
-			score += 1
-			scoreTbl[0] = 1
-		else:
-			score += -dm/(X+Y+1)
-			scoreTbl[1] = -dm/(X+Y+1)
-		dm=X+Y+1
-		dM=0
-		for posH in executionEngine.mdpOperations.holeList:
-			d = distanceM(position,posH)
-			if d>dM:
-				dM=d
-			if d<dm:
-				dm=d
-		if dm == 0:
-			score += -1
-			scoreTbl[2] = -1
-		else:
-			score += dm/(X+Y+1)
-			scoreTbl[3] = dm/(X+Y+1)
+		mdpOperations = executionEngine.mdpOperations
+		return self.scoreGrid(mdpOperations)[1][mdpOperations.getCell(executionEngine.mdpEndState())]
+
+	def getScores(self, mdpOperations, positions): # scores of an array of positions (x,y), as a float32 array
+		positions = np.asarray(positions, dtype=np.int64).reshape((-1,2))
+		return self.scoreGrid(mdpOperations)[0][positions[:,0],positions[:,1]]
+
+def manhattanDistanceGrid(mask): # Manhattan distance of each cell to the nearest cell of mask, walls ignored, inf if mask is empty
+	X,Y = mask.shape
+	d = np.where(mask, 0.0, np.inf)
+	for y in range(1,Y):
+		np.minimum(d[:,y], d[:,y-1]+1, out=d[:,y])
+	for y in range(Y-2,-1,-1):
+		np.minimum(d[:,y], d[:,y+1]+1, out=d[:,y])
+	for x in range(1,X):
+		np.minimum(d[x], d[x-1]+1, out=d[x])
+	for x in range(X-2,-1,-1):
+		np.minimum(d[x], d[x+1]+1, out=d[x])
+	return d
+
+class MDPStateScoreSimple(MDPStateScoreGrid):
+	"""
+	Score using Manhattan distance
+	"""
+	def buildScoreGrid(self, mdpOperations):
+		X,Y = mdpOperations.walls.shape
+		targetX,targetY = np.nonzero(mdpOperations.targets)
+		# sum of the distances to the targets, the sums over x and over y are separable
+		rowSum = np.abs(np.arange(X)[:,np.newaxis]-targetX[np.newaxis,:]).sum(axis=1)
+		columnSum = np.abs(np.arange(Y)[:,np.newaxis]-targetY[np.newaxis,:]).sum(axis=1)
+		score = rowSum[:,np.newaxis]+columnSum[np.newaxis,:] + 10*mdpOperations.holes
+		return -score
 
-		if scoreTbl[0] != 0 or scoreTbl[2] != 0:
-			finalScore = scoreTbl[0] + scoreTbl[2]
-		else:
-			finalScore = (scoreTbl[1]+scoreTbl[3])
-		finalScore = (finalScore+1)/2
-		# print(executionEngine.mdpOperations.replayConsoleStr(executionEngine.mdpEndState()))
-		# print(scoreTbl,":",finalScore)
-		return finalScore
+class MDPStateScoreFast(MDPStateScoreGrid):
+	def buildScoreGrid(self, mdpOperations):
+		X,Y = mdpOperations.walls.shape
+		targetDistance = np.minimum(manhattanDistanceGrid(mdpOperations.targets), X+Y+1)
+		holeDistance = np.minimum(manhattanDistanceGrid(mdpOperations.holes), X+Y+1)
+		onTarget = targetDistance == 0
+		onHole = holeDistance == 0
+		finalScore = np.where(onTarget | onHole, onTarget*1.0 - onHole*1.0, (holeDistance-targetDistance)/(X+Y+1))
+		return (finalScore+1)/2
 
 def normalizeFloat(f,minf,maxf):
 	if minf>maxf:
@@ -750,18 +832,22 @@ def normalizeFloat(f,minf,maxf):
 def normalizeDistance(d,maxd):
 	return normalizeFloat(d,0,maxd)
 
-class MDPStateScoreDistance(MDPStateScoreInterface):
-	def getScore(self, executionEngine):
-		x,y = executionEngine.mdpEndState().position
-		if executionEngine.mdpOperations.targets[x][y]:
-			return 1.0
-		if executionEngine.mdpOperations.holes[x][y]:
-			return 0.0
-		targetScore=1-normalizeDistance(executionEngine.mdpOperations.targetDistance[x][y],executionEngine.mdpOperations.maxTargetDistance)
-		holeScore=normalizeDistance(executionEngine.mdpOperations.holeDistance[x][y],executionEngine.mdpOperations.maxHoleDistance)
+def normalizeDistanceArray(d,maxd): # normalizeDistance of every element of an array
+	if maxd == 0:
+		return np.zeros(np.shape(d))
+	return np.clip(d,0,maxd)/maxd
+
+class MDPStateScoreDistance(MDPStateScoreGrid):
+	def buildScoreGrid(self, mdpOperations):
+		# config holds the normalized distances to holes and to targets
+		targetScore = 1-mdpOperations.config[5]
+		holeScore = mdpOperations.config[4]
 		targetWt=9
 		holeWt=1
-		return normalizeFloat(targetWt*targetScore + holeWt*holeScore,0,targetWt+holeWt)
+		score = np.clip((targetWt*targetScore + holeWt*holeScore)/(targetWt+holeWt),0,1)
+		score[mdpOperations.holes] = 0.0
+		score[mdpOperations.targets] = 1.0
+		return score
 
 class MDPStateScoreNN(MDPStateScoreInterface):
 
@@ -769,34 +855,90 @@ class MDPStateScoreNN(MDPStateScoreInterface):
 		self.model = model
 		self.distanceScore=MDPStateScoreDistance()
 		mdp,initState,initPredicates = readFromFile(layout)
-		walls = mdp.walls
-		holes=mdp.holes
-		targets=mdp.targets
-		pArray = np.zeros((1,len(walls),len(walls[0])))
-		holeDistanceTable = np.zeros((1,len(walls),len(walls[0])))
-		for i in range(len(walls)):
-			for j in range(len(walls[0])):
-				holeDistanceTable[0][i][j] = normalizeDistance(mdp.holeDistance[i][j],mdp.maxHoleDistance)
-		targetDistanceTable = np.zeros((1,len(walls),len(walls[0])))
-		for i in range(len(walls)):
-			for j in range(len(walls[0])):
-				targetDistanceTable[0][i][j] = normalizeDistance(mdp.targetDistance[i][j],mdp.maxTargetDistance)
-		self.array = np.expand_dims(np.concatenate((walls,holes,targets,pArray,holeDistanceTable,targetDistanceTable),axis=0),axis=0)
+		self.array = np.expand_dims(mdp.config,axis=0) # a view, getScore works on a copy
 
 	def getScore(self, executionEngine):
 		position = executionEngine.mdpEndState().position
-		if executionEngine.mdpOperations.targets[position[0]][position[1]]:
+		if executionEngine.mdpOperations.targets[position[0],position[1]]:
 			return 1.0
-		if executionEngine.mdpOperations.holes[position[0]][position[1]]:
+		if executionEngine.mdpOperations.holes[position[0],position[1]]:
 			return 0.0
 		x = np.copy(self.array)
 		x[0][3][position[0]][position[1]] = 1
 		y = self.model(x)[0][0]
 		return 0.9*normalizeFloat(y,0,1)+0.1*self.distanceScore.getScore(executionEngine)
 
+	def getScores(self, mdpOperations, positions): # one call of the model for an array of positions (x,y)
+		positions = np.asarray(positions, dtype=np.int64).reshape((-1,2))
+		x = np.repeat(self.array, len(positions), axis=0)
+		x[np.arange(len(positions)),3,positions[:,0],positions[:,1]] = 1
+		y = np.clip(np.asarray(self.model(x))[:,0],0,1)
+		scores = 0.9*y+0.1*self.distanceScore.getScores(mdpOperations,positions)
+		scores[mdpOperations.holes[positions[:,0],positions[:,1]]] = 0.0
+		scores[mdpOperations.targets[positions[:,0],positions[:,1]]] = 1.0
+		return scores.astype(np.float32)
+
 class MDPStateScore(MDPStateScoreDistance):
 	pass
 
+class MDPScoreCache:
+	"""
+	Scores shared by all the paths that reach the same state, indexed by MDPState.key().
+	At most maxSize scores are kept, the least recently used one is evicted first.
+	Only the scores are shared, the node statistics of the MCTS of adviceMCTS stay per path.
+	"""
+	def __init__(self, maxSize: int = 100000) -> None:
+		if maxSize <= 0:
+			raise Exception(f"bad score cache size: {maxSize}")
+		self.maxSize = maxSize
+		self.scores = collections.OrderedDict() # type: collections.OrderedDict[Any, float]
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, key: Any) -> Optional[float]: # the score of key, None if it is not in the cache
+		score = self.scores.get(key)
+		if score is None:
+			self.misses += 1
+		else:
+			self.hits += 1
+			self.scores.move_to_end(key)
+		return score
+
+	def put(self, key: Any, score: float) -> None:
+		self.scores[key] = score
+		if len(self.scores) > self.maxSize:
+			self.scores.popitem(last=False)
+
+	def clear(self) -> None:
+		self.scores.clear()
+
+	def __len__(self) -> int:
+		return len(self.scores)
+
+class MDPStateScoreCached(MDPStateScoreInterface):
+	"""
+	Score of stateScore cached by position, the scores only depend on the position
+	so each position is scored once. The cache is cleared when the layout changes.
+	Only worth it for scores that are expensive to compute such as MDPStateScoreNN,
+	the MDPStateScoreGrid scores are already a lookup.
+	"""
+	def __init__(self, stateScore: MDPStateScoreInterface, table: Optional[MDPScoreCache] = None) -> None:
+		self.stateScore = stateScore
+		self.table = table if table is not None else MDPScoreCache()
+		self.layoutKey = None # type: Any
+
+	def getScore(self, executionEngine):
+		layoutKey = executionEngine.mdpOperations.layoutKey
+		if layoutKey is not self.layoutKey and layoutKey != self.layoutKey:
+			self.table.clear()
+			self.layoutKey = layoutKey
+		key = executionEngine.mdpEndState().key()
+		score = self.table.get(key)
+		if score is None:
+			score = self.stateScore.getScore(executionEngine)
+			self.table.put(key, score)
+		return score
+
 
 class MDPNonLossPathAdvice(MDPPathAdviceInterface[TMDPPredicate, TMDPState, TMDPAction, TMDPStochasticAction]):
 	def isValidPath(self, mdpExecutionEngine: MDPExecutionEngine[TMDPPredicate, TMDPState, TMDPAction, TMDPStochasticAction]) -> bool:
@@ -961,14 +1103,9 @@ class MDPStormActionAdvice( MDPActionAdviceInterface[TMDPPredicate, TMDPState, T
 		if len(mdpActions)==1:
 			return mdpActions
 		choices = []
-		walls = mdpOperations.walls
-		holes = mdpOperations.holes
-		targets = mdpOperations.targets
 		position = mdpState.position
-		height = len(walls)
-		width = len(walls[0])
 
-		actionValues = getAllValuesFromGrids(walls,holes,targets,position)
+		actionValues = mdpOperations.getStormOracle().getActionValues(position)
 		# print(mdpOperations.replayConsoleStr(mdpState))
 		# print(actionValues)
 
@@ -988,7 +1125,7 @@ class MDPStormDistActionAdvice( MDPActionAdviceInterface[TMDPPredicate, TMDPStat
 		pass
 
 	def deepCopy(self):
-		return MDPStormActionAdvice()
+		return MDPStormDistActionAdvice()
 
 	def _getMDPActionAdviceInSubset(self, mdpActions: List[TMDPAction], mdpState: TMDPState, mdpOperations: TMDPOperations) -> List[TMDPAction]:
 		"""
@@ -998,14 +1135,9 @@ class MDPStormDistActionAdvice( MDPActionAdviceInterface[TMDPPredicate, TMDPStat
 		if len(mdpActions)==1:
 			return mdpActions
 		choices = []
-		walls = mdpOperations.walls
-		holes = mdpOperations.holes
-		targets = mdpOperations.targets
 		position = mdpState.position
-		height = len(walls)
-		width = len(walls[0])
 
-		actionValues = getAllDistValuesFromGrids(walls,holes,targets,position)
+		actionValues = mdpOperations.getStormOracle().getActionDistValues(position)
 		# print(mdpOperations.replayConsoleStr(mdpState))
 		# print(actionValues)
 
@@ -1019,9 +1151,9 @@ class MDPStormDistActionAdvice( MDPActionAdviceInterface[TMDPPredicate, TMDPStat
 		if len(choices)==0:
 			return mdpActions
 
-		# maximize distance
+		# minimize distance among the actions maximizing probability
 		optChoices = []
-		minValue = min([actionValue[1] for actionValue in actionValues])
+		minValue = min([actionValues[['East','West','North','South'].index(action.action)][1] for action in choices])
 		for action in choices:
 			actionId = ['East','West','North','South'].index(action.action)
 			if actionValues[actionId][1] <= minValue:
@@ -1058,15 +1190,15 @@ class MDPDictActionAdvice( MDPActionAdviceInterface[TMDPPredicate, TMDPState, TM
 		maxValue = max([actionValue[0] for actionValue in actionValues])
 		for action in mdpActions:
 			actionId = ['East','West','North','South'].index(action.action)
-			if actionValues[actionId][0] >= maxValue:
+			if actionValues[actionId][0] >= maxValue - 0.001: # the table values differ by rounding noise
 				# print(actionName)
 				choices.append(action)
 		if len(choices)==0:
 			return mdpActions
 
-		# maximize distance
+		# minimize distance among the actions maximizing probability
 		optChoices = []
-		minValue = min([actionValue[1] for actionValue in actionValues])
+		minValue = min([actionValues[['East','West','North','South'].index(action.action)][1] for action in choices])
 		for action in choices:
 			actionId = ['East','West','North','South'].index(action.action)
 			if actionValues[actionId][1] <= minValue:
@@ -1363,47 +1495,32 @@ def createPrismFile(layout,initAction=0):
 	2 = west
 	3 = north
 	4 = south
+	Returns the parsed PRISM program, which getValue and getDistValue take like a file path;
+	no file is left in tempFiles.
 	"""
 
 	mdp, initState,initPredicates = readFromFile(layout)
-	walls = mdp.walls
-	holes = mdp.holes
-	targets = mdp.targets
-	position = initState.position
-
-	height = len(walls)
-	width = len(walls[0])
-	file = createPrismFilefFromGrids(walls,holes,targets,position,initAction)
-	return file
-
-def getValueFromLayout(layout,formula_str = "Pmax=? [F win]"):
-	prismFile = createPrismFile(layout, 0)
-	value = getValue(prismFile,formula_str)
-	# os.system("rm "+prismFile)
+	return createPrismProgramFromGrids(mdp.walls,mdp.holes,mdp.targets,initState.position,initAction)
+
+def createModelFromLayout(layout,initAction=0,builder=PRISM_BUILDER):
+	mdp, initState,initPredicates = readFromFile(layout)
+	return createModelFromGrids(mdp.walls,mdp.holes,mdp.targets,initState.position,initAction,builder)
+
+def getValueFromLayout(layout,formula_str = "Pmax=? [F win]",builder=PRISM_BUILDER):
+	mdp, initState,initPredicates = readFromFile(layout)
+	key = layoutHash(mdp.walls,mdp.holes,mdp.targets,initState.position)
+	prismFile = createModelFromGrids(mdp.walls,mdp.holes,mdp.targets,initState.position,0,builder)
+	value = getValue(prismFile,formula_str,key)
 	return value
 
-def getAllValuesFromLayout(layout):
-	values = []
-	for i in range(1,5):
-		prismFile = createPrismFile(layout, i)
-		value = getValue(prismFile)
-		values.append(value)
-		if DEBUG == True:
-			print(prismFile)
-		else:
-			os.system("rm "+prismFile)
-	return values
-
-def getAllDistValuesFromLayout(layout):
-	values = []
-	for i in range(1,5):
-		prismFile = createPrismFile(layout, i)
-		formula1 = "Pmax=? [F win]"
-		formula2 = "Tmin=? [F win]"
-		value = getDistValue(prismFile,formula1,formula2)
-		values.append(value)
-		# if DEBUG == True:
-		# 	print(prismFile)
-		# else:
-		# 	os.system("rm "+prismFile)
-	return values
+def getValueGridsFromLayout(layout,builder=PRISM_BUILDER):
+	mdp, initState,initPredicates = readFromFile(layout)
+	return getValueGridsFromGrids(mdp.walls,mdp.holes,mdp.targets,initState.position,builder)
+
+def getAllValuesFromLayout(layout,builder=PRISM_BUILDER):
+	mdp, initState,initPredicates = readFromFile(layout)
+	return getAllValuesFromGrids(mdp.walls,mdp.holes,mdp.targets,initState.position,builder)
+
+def getAllDistValuesFromLayout(layout,builder=PRISM_BUILDER):
+	mdp, initState,initPredicates = readFromFile(layout)
+	return getAllDistValuesFromGrids(mdp.walls,mdp.holes,mdp.targets,initState.position,builder)
@@ -0,0 +1,501 @@
+# frozenLakeNative.py
+
+# Value iteration for the frozen lake written with numpy only, so that the analysis can run
+# where stormpy is not installed. It computes the same quantities as ConditionalMinDistEngine:
+# the maximal probability to win (Pmax=? [F win]), the minimal expected distance in the MDP
+# conditioned on winning and restricted to Pmax-optimal actions (Tmin=? [F win]), and the
+# expected distance of a Pmax-optimal strategy in the conditioned MDP keeping all actions.
+#
+# The MDP is compiled into CSR arrays over all free cells of the layout. Win and loss cells
+# are absorbing: the extra end states of the PRISM model are not needed for these properties.
+
+import numpy as np
+import math, sys, glob
+
+from frozenLake import *
+
+ACTIONS = ['North','South','East','West'] # same order as the PRISM commands
+
+PMAX_FORMULA = "Pmax=? [F win]"
+TMIN_FORMULA = "Tmin=? [F win]"
+
+DENSE_SOLVE_LIMIT = 4000 # markov chains with more states are solved by value iteration
+
+def reachableCells(walls, holes, targets, position):
+	# (height, width) mask of the cells reachable from position, a flood fill that stops at win and loss cells.
+	# Every free neighbour of a cell is the intended direction of one of its legal actions.
+	height = len(walls)
+	width = len(walls[0])
+	reachable = np.zeros((height,width), dtype=bool)
+	reachable[position[0]][position[1]] = True
+	stack = [position]
+	while stack != []:
+		i,j = stack.pop()
+		if targets[i][j] or holes[i][j]:
+			continue
+		for ni,nj in [(i-1,j),(i+1,j),(i,j-1),(i,j+1)]:
+			if 0 <= ni < height and 0 <= nj < width and not walls[ni][nj] and not reachable[ni][nj]:
+				reachable[ni][nj] = True
+				stack.append((ni,nj))
+	return reachable
+
+# Qualitative analysis on the grid itself: the cells with Pmax = 0 only depend on the graph of the
+# layout. The action towards a free neighbour reaches it with positive probability, so a cell has
+# Pmax > 0 iff a path of free cells leads from it to a target without going through a hole or a target.
+
+DIRECTIONS = [(-1,0),(1,0),(0,1),(0,-1)] # moves of ACTIONS
+
+def shiftGrid(grid, di, dj): # value of the neighbour (i+di, j+dj) of every cell, False outside the grid
+	height,width = grid.shape
+	shifted = np.zeros_like(grid)
+	shifted[max(0,-di):height-max(0,di), max(0,-dj):width-max(0,dj)] = grid[max(0,di):height-max(0,-di), max(0,dj):width-max(0,-dj)]
+	return shifted
+
+def reachGrid(targets, movesTo):
+	# cells that reach targets with positive probability, movesTo[d] is the mask of the cells with a
+	# choice that moves in direction d with positive probability
+	reach = targets.copy()
+	while True:
+		newReach = reach.copy()
+		for d,(di,dj) in enumerate(DIRECTIONS):
+			newReach |= movesTo[d] & shiftGrid(reach,di,dj)
+		if np.array_equal(newReach, reach):
+			return reach
+		reach = newReach
+
+def positiveGrid(walls, holes, targets):
+	# (height, width) mask of the cells with Pmax=? [F win] > 0, the complement of prob0 among free cells
+	free = ~np.asarray(walls, dtype=bool)
+	win = np.asarray(targets, dtype=bool) & free
+	playing = free & ~win & ~np.asarray(holes, dtype=bool) # cells with choices
+	return reachGrid(win, [playing]*4)
+
+class CompiledLayout():
+	"""
+	CSR representation of the frozen lake MDP over all free cells of a layout, or only over the
+	cells reachable from position with reachableOnly.
+	The choices of state s are choiceStarts[s]:choiceStarts[s+1], the successors of choice c
+	are transitionColumns[transitionStarts[c]:transitionStarts[c+1]].
+	Absorbing and deadlock states have a single self-loop choice with action -1.
+	"""
+	def __init__(self, walls, holes, targets, position, reachableOnly = False):
+		self.height = len(walls)
+		self.width = len(walls[0])
+		self.stateIndex = np.full((self.height,self.width), -1, dtype=np.int64) # -1 for walls and cells that are not states
+		cells = reachableCells(walls, holes, targets, position) if reachableOnly else None
+		statePositions = []
+		for i in range(self.height):
+			for j in range(self.width):
+				if (not walls[i][j]) if cells is None else cells[i][j]:
+					self.stateIndex[i][j] = len(statePositions)
+					statePositions.append((i,j))
+		self.statePositions = np.array(statePositions, dtype=np.int64).reshape((-1,2))
+		self.numStates = len(statePositions)
+		self.initialState = int(self.stateIndex[position[0]][position[1]])
+
+		self.win = np.array([bool(targets[i][j]) for i,j in statePositions], dtype=bool)
+		self.loss = np.array([bool(holes[i][j]) for i,j in statePositions], dtype=bool)
+
+		choiceStarts = [0]
+		choiceActions = []
+		transitionStarts = [0]
+		transitionColumns = []
+		transitionProbabilities = []
+		for state,(i,j) in enumerate(statePositions):
+			numChoices = 0
+			if not (self.win[state] or self.loss[state]):
+				for a,action in enumerate(ACTIONS):
+					if isLegalAction((i,j),action,walls):
+						for label,probability in getStochasticDistribution((i,j),walls,action):
+							ni,nj = getNextPosition((i,j),label)
+							transitionColumns.append(self.stateIndex[ni][nj])
+							transitionProbabilities.append(probability)
+						transitionStarts.append(len(transitionColumns))
+						choiceActions.append(a)
+						numChoices += 1
+			if numChoices == 0: # absorbing or deadlock
+				transitionColumns.append(state)
+				transitionProbabilities.append(1.0)
+				transitionStarts.append(len(transitionColumns))
+				choiceActions.append(-1)
+				numChoices = 1
+			choiceStarts.append(choiceStarts[-1]+numChoices)
+
+		self.choiceStarts = np.array(choiceStarts, dtype=np.int64)
+		self.choiceActions = np.array(choiceActions, dtype=np.int64)
+		self.numChoices = len(choiceActions)
+		self.choiceStates = np.repeat(np.arange(self.numStates), np.diff(self.choiceStarts))
+		self.transitionStarts = np.array(transitionStarts, dtype=np.int64)
+		self.transitionColumns = np.array(transitionColumns, dtype=np.int64)
+		self.transitionProbabilities = np.array(transitionProbabilities, dtype=np.float64)
+		self.transitionChoices = np.repeat(np.arange(self.numChoices), np.diff(self.transitionStarts))
+
+	def choiceSums(self, transitionValues):
+		# sum of the values of the transitions of each choice
+		return np.bincount(self.transitionChoices, weights=transitionValues, minlength=self.numChoices)
+
+	def stateMax(self, choiceValues):
+		return np.maximum.reduceat(choiceValues, self.choiceStarts[:-1])
+
+	def stateMin(self, choiceValues):
+		return np.minimum.reduceat(choiceValues, self.choiceStarts[:-1])
+
+	def stateAny(self, choiceMask):
+		return np.logical_or.reduceat(choiceMask, self.choiceStarts[:-1])
+
+	def stateMask(self, positions): # mask of the states of an (n, 2) array of positions, walls are ignored
+		mask = np.zeros(self.numStates, dtype=bool)
+		states = self.stateIndex[positions[:,0],positions[:,1]]
+		mask[states[states >= 0]] = True
+		return mask
+
+	def toGrid(self, stateValues):
+		# (height, width) array with NaN for walls
+		grid = np.full((self.height,self.width), np.nan)
+		grid[self.statePositions[:,0],self.statePositions[:,1]] = stateValues
+		return grid
+
+class CompiledSubset():
+	"""
+	The choices and transitions of a subset of the states of a CompiledLayout, with the same
+	choiceSums, stateMax and stateMin, so that value iteration only updates these states.
+	Transition values are given for the transitions of the subset (compiled arrays indexed by transitions).
+	"""
+	def __init__(self, compiled, states):
+		self.states = np.flatnonzero(states)
+		self.choices = np.flatnonzero(states[compiled.choiceStates])
+		self.transitions = np.flatnonzero(states[compiled.choiceStates[compiled.transitionChoices]])
+		self.transitionChoices = np.searchsorted(self.choices, compiled.transitionChoices[self.transitions])
+		self.transitionColumns = compiled.transitionColumns[self.transitions]
+		self.choiceStarts = np.searchsorted(self.choices, compiled.choiceStarts[self.states])
+
+	def choiceSums(self, transitionValues):
+		return np.bincount(self.transitionChoices, weights=transitionValues, minlength=len(self.choices))
+
+	def stateMax(self, choiceValues):
+		return np.maximum.reduceat(choiceValues, self.choiceStarts)
+
+	def stateMin(self, choiceValues):
+		return np.minimum.reduceat(choiceValues, self.choiceStarts)
+
+def canReach(compiled, targets, choiceMask, probabilities, strategy = None):
+	"""
+	States that reach targets with positive probability using only the choices in choiceMask.
+	If strategy is an array over states, the choice that first moves each state closer to
+	targets is written in it.
+	"""
+	reach = targets.copy()
+	positive = probabilities > 0
+	while True:
+		hit = (compiled.choiceSums(positive & reach[compiled.transitionColumns]) > 0) & choiceMask
+		newReach = reach | compiled.stateAny(hit)
+		if strategy is not None:
+			added = hit & ~reach[compiled.choiceStates]
+			firstHit = np.full(compiled.numStates, compiled.numChoices)
+			np.minimum.at(firstHit, compiled.choiceStates[added], np.flatnonzero(added))
+			strategy[newReach & ~reach] = firstHit[newReach & ~reach]
+		if np.array_equal(newReach, reach):
+			return reach
+		reach = newReach
+
+def prob1E(compiled, targets, states, choiceMask, probabilities, strategy = None):
+	"""
+	States of the set states from which some strategy using the choices in choiceMask
+	stays in states and reaches targets with probability 1.
+	"""
+	positive = probabilities > 0
+	candidates = states.copy()
+	while True:
+		leaving = compiled.choiceSums(positive & ~candidates[compiled.transitionColumns]) > 0
+		safe = choiceMask & ~leaving & candidates[compiled.choiceStates]
+		reach = canReach(compiled, targets & candidates, safe, probabilities, strategy) & candidates
+		if np.array_equal(reach, candidates):
+			return candidates, safe
+		candidates = reach
+
+def hasConverged(old, new, precision):
+	# relative difference, like the default convergence criterion of storm
+	finite = np.isfinite(new)
+	diff = np.abs(new[finite]-old[finite])
+	scale = np.abs(new[finite])
+	return bool(np.all(diff <= precision*np.where(scale > 0, scale, 1.0)))
+
+class NativeConditionalMinDistEngine():
+
+	def __init__(self, compiled, precision = 1e-6, threshold = 0.00001):
+		self.compiled = compiled
+		self.precision = precision
+		self.threshold = threshold # tolerance to decide if an action is optimal
+
+	def getValue(self, formula = PMAX_FORMULA, start = None, frozen = None): # maximal probability to win for each state
+		# start: values to start value iteration from, must be a lower bound of the result
+		# frozen: states whose value in start is already the result
+		checkFormula(formula, PMAX_FORMULA)
+		c = self.compiled
+		# graph precomputation, as storm does: states with probability 0 and 1 are fixed
+		allChoices = np.ones(c.numChoices, dtype=bool)
+		reachable = canReach(c, c.win, allChoices, c.transitionProbabilities)
+		self.sureStrategy = np.full(c.numStates, -1)
+		sure, safe = prob1E(c, c.win, reachable, allChoices, c.transitionProbabilities, self.sureStrategy)
+		self.sure = sure
+		undecided = reachable & ~sure
+		result = sure.astype(np.float64)
+		if frozen is not None:
+			undecided = undecided & ~frozen
+			result = np.where(frozen, start, result)
+		if start is not None:
+			result = np.where(undecided, start, result)
+		sub = CompiledSubset(c, undecided)
+		probabilities = c.transitionProbabilities[sub.transitions]
+		while len(sub.states) > 0:
+			best = sub.stateMax(sub.choiceSums(probabilities*result[sub.transitionColumns]))
+			converged = hasConverged(result[sub.states], best, self.precision)
+			result[sub.states] = best
+			if converged:
+				break
+		self.result = result
+		self.choiceValues = c.choiceSums(c.transitionProbabilities*result[c.transitionColumns])
+		return result
+
+	def getBestChoices(self): # mask of the Pmax-optimal choices
+		c = self.compiled
+		best = c.stateMax(self.choiceValues)
+		return self.choiceValues >= best[c.choiceStates] - self.threshold
+
+	def removeBadStates(self): # condition on winning, keeping only the optimal choices of good states
+		c = self.compiled
+		goodStates = self.result > 0
+		self.goodStates = goodStates
+		transitionStates = c.choiceStates[c.transitionChoices]
+		self.newProbabilities = np.where(goodStates[transitionStates], c.transitionProbabilities*self.result[c.transitionColumns]/np.where(goodStates[transitionStates], self.result[transitionStates], 1.0), 0.0)
+		self.newChoices = self.getBestChoices() & goodStates[c.choiceStates]
+		return self.newProbabilities, self.newChoices
+
+	def removeBadStatesKeepActions(self): # condition on winning, keeping all the choices of good states
+		c = self.compiled
+		self.newChoicesConditional = self.goodStates[c.choiceStates]
+		return self.newProbabilities, self.newChoicesConditional
+
+	def getBestDistValue(self, formula = TMIN_FORMULA, start = None, frozen = None): # minimal expected distance in the conditioned MDP
+		# start: values to start value iteration from, any finite values converge to the result
+		# frozen: states whose value in start is already the result
+		checkFormula(formula, TMIN_FORMULA)
+		c = self.compiled
+		states, safe = prob1E(c, c.win, self.goodStates, self.newChoices, self.newProbabilities)
+		newResult = np.where(states, 0.0, math.inf)
+		undecided = states & ~c.win
+		if frozen is not None:
+			undecided = undecided & ~frozen
+			newResult = np.where(frozen, start, newResult)
+		if start is not None:
+			newResult = np.where(undecided & np.isfinite(start), start, newResult)
+		sub = CompiledSubset(c, undecided)
+		probabilities = self.newProbabilities[sub.transitions]
+		subSafe = safe[sub.choices]
+		while len(sub.states) > 0:
+			finite = np.where(np.isfinite(newResult), newResult, 0.0)
+			choiceValues = np.where(subSafe, 1+sub.choiceSums(probabilities*finite[sub.transitionColumns]), math.inf)
+			values = sub.stateMin(choiceValues)
+			converged = hasConverged(newResult[sub.states], values, self.precision)
+			newResult[sub.states] = values
+			if converged:
+				break
+		self.newResult = newResult
+		return newResult
+
+	def getStormDistValue(self, formula = TMIN_FORMULA):
+		# expected distance in the conditioned MDP keeping all actions, under a Pmax-optimal strategy.
+		# As in storm, states with probability 1 follow the strategy of the graph precomputation and
+		# the other states take their first optimal choice; the value depends on this tie-breaking.
+		checkFormula(formula, TMIN_FORMULA)
+		c = self.compiled
+		best = c.stateMax(self.choiceValues)
+		isBest = self.choiceValues >= best[c.choiceStates]
+		firstBest = np.full(c.numStates, c.numChoices)
+		np.minimum.at(firstBest, c.choiceStates[isBest], np.flatnonzero(isBest))
+		firstBest = np.where(self.sure & ~c.win, self.sureStrategy, firstBest)
+		scheduler = np.zeros(c.numChoices, dtype=bool)
+		scheduler[firstBest] = True
+		self.newStormResult = expectedSteps(c, c.win, scheduler, self.newProbabilities, self.precision)
+		return self.newStormResult
+
+	def process(self, formula1, formula2):
+		self.getValue(formula1)
+		self.removeBadStates()
+		self.removeBadStatesKeepActions()
+		self.getBestDistValue(formula2)
+		self.getStormDistValue(formula2)
+
+	def getFinalValues(self): # same as ConditionalMinDistEngine.getFinalValues
+		initialState = self.compiled.initialState
+		return float(self.result[initialState]), float(self.newResult[initialState]), float(self.newStormResult[initialState])
+
+	def getValueGrids(self): # (height, width) grids of the three values, NaN for walls
+		return self.compiled.toGrid(self.result), self.compiled.toGrid(self.newResult), self.compiled.toGrid(self.newStormResult)
+
+def expectedSteps(compiled, targets, scheduler, probabilities, precision):
+	"""
+	Expected number of steps to reach targets in the markov chain given by the choices in scheduler.
+	States that do not reach targets with probability 1 get infinity.
+	"""
+	c = compiled
+	reach = canReach(c, targets, scheduler, probabilities)
+	notOne = canReach(c, ~reach, scheduler, probabilities)
+	states = ~notOne & ~targets
+	values = np.where(notOne, math.inf, 0.0)
+	index = np.full(c.numStates, -1)
+	index[states] = np.arange(int(states.sum()))
+	n = int(states.sum())
+	if n == 0:
+		return values
+	rows = c.choiceStates[c.transitionChoices]
+	used = scheduler[c.transitionChoices] & states[rows] & states[c.transitionColumns] & (probabilities > 0)
+	if n <= DENSE_SOLVE_LIMIT: # solve (I - P) x = 1
+		matrix = np.eye(n)
+		np.add.at(matrix, (index[rows[used]], index[c.transitionColumns[used]]), -probabilities[used])
+		values[states] = np.linalg.solve(matrix, np.ones(n))
+		return values
+	x = np.zeros(n)
+	while True:
+		newX = 1+np.bincount(index[rows[used]], weights=probabilities[used]*x[index[c.transitionColumns[used]]], minlength=n)
+		if hasConverged(x, newX, precision):
+			break
+		x = newX
+	values[states] = newX
+	return values
+
+def checkFormula(formula, expected):
+	if " ".join(formula.split()) != expected:
+		raise Exception("Unsupported formula for the native engine: "+formula+" (expected "+expected+")")
+
+def compileLayout(layout):
+	walls, holes, targets, position = gridsFromFile(layout)
+	return CompiledLayout(walls, holes, targets, position)
+
+def getNativeDistValue(layout, formula1 = PMAX_FORMULA, formula2 = TMIN_FORMULA):
+	# mirrors getDistValue(prismFile, formula1, formula2) for a layout file
+	c = NativeConditionalMinDistEngine(compileLayout(layout))
+	c.process(formula1, formula2)
+	return c.getFinalValues()
+
+def getNativeValueGrids(layout, formula1 = PMAX_FORMULA, formula2 = TMIN_FORMULA):
+	c = NativeConditionalMinDistEngine(compileLayout(layout))
+	c.process(formula1, formula2)
+	return c.getValueGrids()
+
+# Incremental analysis of a layout edited cell by cell
+
+WALL = 'wall'
+HOLE = 'hole'
+TARGET = 'target'
+EMPTY = 'empty'
+CELL_TYPES = [WALL, HOLE, TARGET, EMPTY]
+
+IMPROVING_EDITS = [(HOLE, EMPTY), (HOLE, TARGET), (EMPTY, TARGET)] # edits that can only increase Pmax
+
+def getCellType(walls, holes, targets, position):
+	x,y = position
+	if walls[x][y]:
+		return WALL
+	elif holes[x][y]:
+		return HOLE
+	elif targets[x][y]:
+		return TARGET
+	else:
+		return EMPTY
+
+def applyCellEdits(walls, holes, targets, edits):
+	# copies of the grids where each (position, cell type) of edits is applied
+	walls, holes, targets = gridCopy(walls), gridCopy(holes), gridCopy(targets)
+	for (x,y),cellType in edits:
+		if cellType not in CELL_TYPES:
+			raise Exception("Unknown cell type: "+str(cellType))
+		walls[x][y] = cellType == WALL
+		holes[x][y] = cellType == HOLE
+		targets[x][y] = cellType == TARGET
+	return walls, holes, targets
+
+class IncrementalAnalysis():
+	"""
+	Values of all the cells of a layout, with edited() giving the values after a list of cell edits
+	without solving again from scratch. Only the states that can reach an edited cell, before or after
+	the edits, are iterated again. Pmax starts from the previous values when all edits can only
+	increase it (they are then a lower bound), and from 0 otherwise. Tmin always starts from the
+	previous values: with a cost of 1 per step its fixed point is unique. The storm strategy
+	distance is computed again for all states; as it depends on how ties between optimal choices
+	are broken, it can differ from the one of a full solve.
+	"""
+	def __init__(self, walls, holes, targets, precision = 1e-6, threshold = 0.00001):
+		self.walls = walls
+		self.holes = holes
+		self.targets = targets
+		self.precision = precision
+		self.threshold = threshold
+		self.compiled = self.compile()
+		self.engine = self.solve()
+
+	def compile(self):
+		free = [(i,j) for i in range(len(self.walls)) for j in range(len(self.walls[0])) if not self.walls[i][j]]
+		if free == []:
+			raise Exception("No free cell in the layout")
+		return CompiledLayout(self.walls, self.holes, self.targets, free[0]) # every cell is a state, the initial one is not used
+
+	def solve(self, start = None, distanceStart = None, frozen = None):
+		engine = NativeConditionalMinDistEngine(self.compiled, self.precision, self.threshold)
+		engine.getValue(PMAX_FORMULA, start, frozen)
+		engine.removeBadStates()
+		engine.removeBadStatesKeepActions()
+		engine.getBestDistValue(TMIN_FORMULA, distanceStart, frozen)
+		engine.getStormDistValue(TMIN_FORMULA)
+		return engine
+
+	def edited(self, edits):
+		# new IncrementalAnalysis of the layout with the edits, this one is not changed
+		edits = [(position,cellType) for position,cellType in edits if getCellType(self.walls, self.holes, self.targets, position) != cellType]
+		walls, holes, targets = applyCellEdits(self.walls, self.holes, self.targets, edits)
+		new = IncrementalAnalysis.__new__(IncrementalAnalysis)
+		new.walls, new.holes, new.targets = walls, holes, targets
+		new.precision = self.precision
+		new.threshold = self.threshold
+		new.compiled = new.compile()
+		old, c = self.compiled, new.compiled
+
+		# states that can reach an edited cell with positive probability, in the new or in the old layout
+		editedCells = np.array([position for position,cellType in edits], dtype=np.int64).reshape((-1,2))
+		oldAffected = canReach(old, old.stateMask(editedCells), np.ones(old.numChoices, dtype=bool), old.transitionProbabilities)
+		affected = canReach(c, c.stateMask(editedCells), np.ones(c.numChoices, dtype=bool), c.transitionProbabilities)
+		oldIndex = old.stateIndex[c.statePositions[:,0],c.statePositions[:,1]] # -1 for cells that were walls
+		affected = affected | (oldIndex < 0) | oldAffected[oldIndex]
+
+		previous = np.where(oldIndex >= 0, self.engine.result[oldIndex], 0.0)
+		previousDistance = np.where(oldIndex >= 0, self.engine.newResult[oldIndex], math.inf)
+		improving = all([(getCellType(self.walls, self.holes, self.targets, position), cellType) in IMPROVING_EDITS for position,cellType in edits])
+		start = previous if improving else np.where(affected, 0.0, previous)
+		new.engine = new.solve(start, previousDistance, ~affected)
+		new.affected = affected
+		return new
+
+	def getFinalValues(self, position): # probability, distance and storm distance from position
+		state = self.compiled.stateIndex[position[0]][position[1]]
+		if state < 0:
+			raise Exception("No state for the wall at "+str(position))
+		return float(self.engine.result[state]), float(self.engine.newResult[state]), float(self.engine.newStormResult[state])
+
+	def getValueGrids(self):
+		return self.engine.getValueGrids()
+
+def compareWithResults(resultsFile = "results.csv", file = sys.stdout):
+	# diff the native values against a results.csv produced by useOptStrategy.py
+	f = open(resultsFile)
+	lines = f.read().split("\n")[1:]
+	f.close()
+	print("layout, probability, native probability, opt cond exp dist, native opt cond exp dist, cond exp dist storm, native cond exp dist storm", file = file)
+	for line in lines:
+		if line.strip() == "":
+			continue
+		layout, probability, distance, distanceStorm = [s.strip() for s in line.split(",")]
+		v = getNativeDistValue(layout)
+		print(f"{layout}, {probability}, {v[0]}, {distance}, {v[1]}, {distanceStorm}, {v[2]}", file = file)
+
+if __name__ == "__main__":
+	compareWithResults()
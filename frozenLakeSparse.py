@@ -0,0 +1,265 @@
+# frozenLakeSparse.py
+
+# Builds the frozen lake MDP directly as a stormpy.storage.SparseMdp from the grids,
+# without writing a PRISM file. The model is the same as the one storm builds from
+# prismStrFromGrids: one state per reachable (x,y,end), choices in the order
+# of the PRISM commands (North, South, East, West), labels "init", "win", "loss" and
+# the default reward structure.
+
+import stormpy, os, sys, glob, time, random
+import stormpy.storage
+import numpy as np
+
+from frozenLake import *
+from instrumentation import instrumented
+from conditionalMinDist import buildMatrix
+
+ACTIONS = ['North','South','East','West'] # order of the commands in the PRISM file
+
+@instrumented("createSparseMdp")
+def createSparseMdpFromGrids(walls,holes,targets,position):
+	# explore the states reachable from the initial position, like storm does
+	stateIds = {(position[0],position[1],False): 0}
+	states = [(position[0],position[1],False)]
+	choices = [] # for each state, a list of (action label, {successor: probability})
+	deadlocks = [] # states without legal action, labelled "deadlock" as storm does
+	i = 0
+	while i < len(states):
+		x,y,end = states[i]
+		stateChoices = []
+		if end:
+			stateChoices.append((None,{(x,y,True): 1.0})) # [] (win | loss) -> (end'=true)
+		elif targets[x][y] or holes[x][y]:
+			stateChoices.append((None,{(x,y,True): 1.0}))
+		else:
+			for action in ACTIONS:
+				if isLegalAction((x,y),action,walls):
+					successors = {}
+					for label,probability in getStochasticDistribution((x,y),walls,action):
+						nx,ny = getNextPosition((x,y),label)
+						successors[(nx,ny,False)] = probability
+					stateChoices.append((action,successors))
+			if stateChoices == []:
+				stateChoices.append((None,{(x,y,False): 1.0})) # deadlock, fixed with a self-loop as storm does
+				deadlocks.append(i)
+		for action,successors in stateChoices:
+			for successor in successors:
+				if successor not in stateIds:
+					stateIds[successor] = len(states)
+					states.append(successor)
+		choices.append(stateChoices)
+		i += 1
+
+	numStates = len(states)
+	numChoices = sum([len(stateChoices) for stateChoices in choices])
+
+	# transition matrix, one row group per state and one row per choice
+	builder = stormpy.SparseMatrixBuilder(rows=numChoices, columns=numStates, entries=0, force_dimensions=True, has_custom_row_grouping=True, row_groups=numStates)
+	choiceLabeling = stormpy.storage.ChoiceLabeling(numChoices)
+	for action in ACTIONS:
+		choiceLabeling.add_label(action)
+	stateActionRewards = [0.0 for c in range(numChoices)]
+	numChoices = 0
+	for state in range(numStates):
+		builder.new_row_group(numChoices)
+		for action,successors in choices[state]:
+			for column in sorted([stateIds[successor] for successor in successors]): # columns must be added in increasing order
+				builder.add_next_value(numChoices, column, successors[states[column]])
+			if action is not None:
+				choiceLabeling.add_label_to_choice(action, numChoices)
+				stateActionRewards[numChoices] = -1.0
+			numChoices += 1
+	transition_matrix = builder.build()
+
+	# labels
+	state_labeling = stormpy.storage.StateLabeling(numStates)
+	for label in ["init","win","loss","deadlock"]:
+		state_labeling.add_label(label)
+	state_labeling.add_label_to_state("init", 0)
+	for state in deadlocks:
+		state_labeling.add_label_to_state("deadlock", state)
+	stateRewards = [0.0 for s in range(numStates)]
+	for state in range(numStates):
+		x,y,end = states[state]
+		if targets[x][y]:
+			state_labeling.add_label_to_state("win", state)
+			if not end:
+				stateRewards[state] += 100.0
+		if holes[x][y]:
+			state_labeling.add_label_to_state("loss", state)
+			if not end:
+				stateRewards[state] += -100.0
+
+	# state valuations, so that states can be mapped back to positions
+	manager = stormpy.ExpressionManager()
+	variableEnd = manager.create_boolean_variable("end")
+	variableX = manager.create_integer_variable("x")
+	variableY = manager.create_integer_variable("y")
+	valuationsBuilder = stormpy.storage.StateValuationsBuilder()
+	valuationsBuilder.add_variable(variableEnd)
+	valuationsBuilder.add_variable(variableX)
+	valuationsBuilder.add_variable(variableY)
+	for state in range(numStates):
+		x,y,end = states[state]
+		valuationsBuilder.add_state(state, [end], [x,y], [])
+
+	reward_models = {}
+	reward_models[""] = stormpy.SparseRewardModel(optional_state_reward_vector=stateRewards, optional_state_action_reward_vector=stateActionRewards)
+
+	components = stormpy.SparseModelComponents(transition_matrix=transition_matrix, state_labeling=state_labeling, reward_models=reward_models, rate_transitions=False)
+	components.choice_labeling = choiceLabeling
+	components.state_valuations = valuationsBuilder.build()
+	model = stormpy.storage.SparseMdp(components)
+	return model
+
+# Pruned model: only the cells reachable from the initial position, numbered densely in row-major
+# order by a flood fill (frozenLakeNative.CompiledLayout with reachableOnly), and one absorbing state
+# shared by all the win and loss cells instead of an end state per cell. The state valuations map the
+# states back to (x,y) as for the other builders; the absorbing state is the only one with end true.
+# With pruneZero, the cells with Pmax = 0 found by frozenLakeNative.positiveGrid also step to the
+# absorbing state, so the cells only reachable through them are not in the model. They keep their
+# state, with value 0, but not the loss label.
+
+@instrumented("createSparseMdp")
+def createPrunedMdpFromGrids(walls,holes,targets,position,pruneZero = True):
+	from frozenLakeNative import CompiledLayout, positiveGrid
+	terminalHoles = holes
+	if pruneZero:
+		zero = ~positiveGrid(walls,holes,targets)
+		zero[position[0]][position[1]] = False
+		terminalHoles = np.asarray(holes, dtype=bool) | zero
+	c = CompiledLayout(walls,terminalHoles,targets,position,reachableOnly=True)
+	loss = np.array([bool(holes[x][y]) for x,y in c.statePositions.tolist()], dtype=bool)
+	absorbing = c.numStates
+	numStates = c.numStates+1
+	numChoices = c.numChoices+1
+
+	# win and loss cells step to the absorbing state, which loops on itself
+	columns = c.transitionColumns.copy()
+	terminal = c.win | c.loss
+	columns[c.transitionStarts[c.choiceStarts[:-1][terminal]]] = absorbing
+	rows = np.append(c.transitionChoices, c.numChoices)
+	columns = np.append(columns, absorbing)
+	values = np.append(c.transitionProbabilities, 1.0)
+	order = np.lexsort((columns, rows)) # columns must be increasing in each row
+	transition_matrix = buildMatrix(rows[order], columns[order], values[order], numChoices, numStates, np.append(c.choiceStarts[:-1], c.numChoices))
+
+	choiceLabeling = stormpy.storage.ChoiceLabeling(numChoices)
+	for action in ACTIONS:
+		choiceLabeling.add_label(action)
+	for choice in np.flatnonzero(c.choiceActions >= 0):
+		choiceLabeling.add_label_to_choice(ACTIONS[c.choiceActions[choice]], int(choice))
+	stateActionRewards = np.append(np.where(c.choiceActions >= 0, -1.0, 0.0), 0.0)
+
+	state_labeling = stormpy.storage.StateLabeling(numStates)
+	for label in ["init","win","loss","deadlock"]:
+		state_labeling.add_label(label)
+	state_labeling.add_label_to_state("init", c.initialState)
+	for state in np.flatnonzero(c.win):
+		state_labeling.add_label_to_state("win", int(state))
+	for state in np.flatnonzero(loss):
+		state_labeling.add_label_to_state("loss", int(state))
+	for state in np.flatnonzero((c.choiceActions[c.choiceStarts[:-1]] < 0) & ~terminal): # self-loop on a cell that is not a win or loss cell
+		state_labeling.add_label_to_state("deadlock", int(state))
+	stateRewards = np.append(100.0*c.win - 100.0*loss, 0.0)
+
+	manager = stormpy.ExpressionManager()
+	variableEnd = manager.create_boolean_variable("end")
+	variableX = manager.create_integer_variable("x")
+	variableY = manager.create_integer_variable("y")
+	valuationsBuilder = stormpy.storage.StateValuationsBuilder()
+	valuationsBuilder.add_variable(variableEnd)
+	valuationsBuilder.add_variable(variableX)
+	valuationsBuilder.add_variable(variableY)
+	for state,(x,y) in enumerate(c.statePositions.tolist()):
+		valuationsBuilder.add_state(state, [False], [x,y], [])
+	valuationsBuilder.add_state(absorbing, [True], [position[0],position[1]], [])
+
+	reward_models = {}
+	reward_models[""] = stormpy.SparseRewardModel(optional_state_reward_vector=stateRewards.tolist(), optional_state_action_reward_vector=stateActionRewards.tolist())
+
+	components = stormpy.SparseModelComponents(transition_matrix=transition_matrix, state_labeling=state_labeling, reward_models=reward_models, rate_transitions=False)
+	components.choice_labeling = choiceLabeling
+	components.state_valuations = valuationsBuilder.build()
+	return stormpy.storage.SparseMdp(components)
+
+# Timing comparison with the PRISM path
+
+def compareBuilders(gridList, formula_str = "Pmax=? [F win]"):
+	"""
+	gridList is a list of (name, (walls, holes, targets, position)).
+	Returns a list of (name, number of states, prism time, sparse time, prism value, sparse value).
+	Prism time and value are None when storm fails on the PRISM file (large grids).
+	"""
+	from frozenLakeStorm import createPrismProgramFromGrids, getValue
+	rows = []
+	for name,(walls,holes,targets,position) in gridList:
+		t0 = time.time()
+		try:
+			prismFile = createPrismProgramFromGrids(walls,holes,targets,position,0)
+			prismValue = getValue(prismFile,formula_str)
+			prismTime = time.time()-t0
+		except Exception as error:
+			print(f"prism path failed on {name}: {str(error)[:200]}", file = sys.stderr)
+			prismValue = None
+			prismTime = None
+		t1 = time.time()
+		model = createSparseMdpFromGrids(walls,holes,targets,position)
+		sparseValue = getValue(model,formula_str)
+		t2 = time.time()
+		rows.append((name,model.nr_states,prismTime,t2-t1,prismValue,sparseValue))
+	return rows
+
+def compareOracles(gridList, builder = None):
+	"""
+	gridList is a list of (name, (walls, holes, targets, position)).
+	Queries every free cell with a StormOracle on builder (the pruned one by default) and on the
+	sparse builder, returns a list of (name, position, error) for the cells where they differ or fail.
+	"""
+	from frozenLakeStorm import StormOracle, SPARSE_BUILDER, PRUNED_BUILDER
+	if builder is None:
+		builder = PRUNED_BUILDER
+	failures = []
+	for name,(walls,holes,targets,position) in gridList:
+		oracle = StormOracle(walls,holes,targets,builder)
+		reference = StormOracle(walls,holes,targets,SPARSE_BUILDER)
+		for i in range(len(walls)):
+			for j in range(len(walls[i])):
+				if walls[i][j]:
+					continue
+				try:
+					values = oracle.getActionDistValues((i,j))
+				except Exception as error:
+					failures.append((name,(i,j),f"{type(error).__name__}: {error}"))
+					continue
+				expected = reference.getActionDistValues((i,j))
+				if not np.allclose(np.array(values)[:,:2], np.array(expected)[:,:2], rtol=1e-4, atol=1e-6): # both solved by value iteration
+					failures.append((name,(i,j),f"{values} instead of {expected}"))
+	return failures
+
+def printComparison(rows, file = sys.stdout):
+	print("layout, states, prism time, sparse time, speedup, prism value, sparse value", file = file)
+	for name,numStates,prismTime,sparseTime,prismValue,sparseValue in rows:
+		if prismTime is None:
+			print(f"{name}, {numStates}, failed, {sparseTime:.4f}, , , {sparseValue}", file = file)
+		else:
+			print(f"{name}, {numStates}, {prismTime:.4f}, {sparseTime:.4f}, {prismTime/sparseTime:.2f}, {prismValue}, {sparseValue}", file = file)
+	rows = [row for row in rows if row[2] is not None]
+	if rows == []:
+		return
+	totalPrism = sum([row[2] for row in rows])
+	totalSparse = sum([row[3] for row in rows])
+	print(f"total, , {totalPrism:.4f}, {totalSparse:.4f}, {totalPrism/totalSparse:.2f}, , ", file = file)
+
+if __name__ == "__main__":
+	layouts = sorted(glob.glob("layout/*.lay"))
+	printComparison(compareBuilders([(layout,gridsFromFile(layout)) for layout in layouts]))
+	random.seed(0)
+	synthetic = []
+	for size in [20,40,80]:
+		synthetic.append((f"random_{size}x{size}",createRandomGrid(1,size,size)))
+	printComparison(compareBuilders(synthetic))
+	failures = compareOracles([(layout,gridsFromFile(layout)) for layout in layouts])
+	for name,position,error in failures:
+		print(f"oracle check failed on {name} {position}: {error}")
+	print(f"oracle check: {len(failures)} failures")
@@ -1,24 +1,35 @@
-import stormpy, os, sys
+import stormpy, os, sys, math, io, tempfile
 import gc
 
 CURRENTPWD = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.join(CURRENTPWD, '../src'))
 
 import adviceMCTS.util as util
-from adviceMCTS.conditionalMinDist import getDistValue
+from conditionalMinDist import getDistValue, getDistPositionValues, getStatePositions, parseProperties, loadPrismProgram, ConditionalMinDistSession, StormOptions, modelChecking, optionsQuery
+from frozenLakeSparse import createSparseMdpFromGrids, createPrunedMdpFromGrids
+from frozenLake import isLegalAction, getStochasticDistribution, getNextPosition, INTENDED_WEIGHT, SLIP_WEIGHT
+from resultStore import getStored, putStored, queryKey
+from instrumentation import phase, instrumented
 
 DEBUG = False
 
-TEMP_DIR = 'tempFiles'+os.sep+'prism'
-util.mkdir(TEMP_DIR)
+ACTIONS = ['East','West','North','South'] # initAction 1 to 4, also the order of the values returned below
 
-# This function creates a prism file from the given grids and the initial position of the robot
-def createPrismFilefFromGrids(walls,holes,targets,position,initAction):
+PRISM_BUILDER = 'prism' # let storm build the model of prismStrFromGrids
+SPARSE_BUILDER = 'sparse' # build the SparseMdp directly from the grids
+COMPACT_BUILDER = 'compact' # let storm build the model of compactPrismStrFromGrids
+TEMPLATE_BUILDER = 'template' # same model, from a PRISM template parsed once per grid size
+PRUNED_BUILDER = 'pruned' # SparseMdp of the reachable cells only, cut at the cells with Pmax = 0, and a single absorbing state
+
+TEMP_DIR = 'tempFiles'+os.sep+'prism' # only for the files of createPrismFilefFromGrids, created on first use
+
+# This function creates the PRISM text of the given grids and the initial position of the robot
+@instrumented("createPrismFile")
+def prismStrFromGrids(walls,holes,targets,position):
 	height = len(walls)
 	width = len(walls[0])
 
-	fname = TEMP_DIR+os.sep+str(os.getpid())+f'_{initAction}.nm'
-	f = open(fname,'w+')
+	f = io.StringIO()
 
 	print ('mdp\n', file = f)
 
@@ -113,15 +124,225 @@ def createPrismFilefFromGrids(walls,holes,targets,position,initAction):
 
 	print('label "win" = win;', file = f)
 	print('label "loss" = loss;', file = f)
-	f.close()
-	return(fname)
+	return f.getvalue()
+
+def balancedOr(clauses): # disjunction nested as a balanced tree, storm fails on deep expressions
+	if clauses == []:
+		return 'false'
+	if len(clauses) == 1:
+		return clauses[0]
+	m = len(clauses)//2
+	return f'({balancedOr(clauses[:m])} | {balancedOr(clauses[m:])})'
+
+def indexTree(variable,lo,hi,leaf): # expression equal to leaf(i) when variable is i, for lo <= i < hi, as a binary search
+	if hi-lo == 1:
+		return leaf(lo)
+	m = (lo+hi)//2
+	left = indexTree(variable,lo,m,leaf)
+	right = indexTree(variable,m,hi,leaf)
+	if left == right: # often both false
+		return left
+	return f'({variable}<{m} ? {left} : {right})'
+
+def cellSetGuard(cells,height,width):
+	# guard true on the cells of a (height, width) boolean grid: a binary search on x, then the runs of y of the row
+	def runs(i):
+		clauses = []
+		j = 0
+		while j < width:
+			if cells[i][j]:
+				k = j
+				while k+1 < width and cells[i][k+1]:
+					k += 1
+				clauses.append(f'y={j}' if k == j else f'(y>={j} & y<={k})')
+				j = k+1
+			else:
+				j += 1
+		return balancedOr(clauses)
+	return indexTree('x',0,height,runs)
+
+def robotModuleLines(height,width,initX,initY):
+	# module, rewards and labels of the compact encodings, after the formulas north, south, east, west, win and loss
+	w = f'{INTENDED_WEIGHT:g}'
+	s = f'{SLIP_WEIGHT:g}'
+	return [f'formula {name}Int = {name}?1:0;' for name in ['north','south','east','west']] + [
+		'',
+		'module robot',
+		f'x : [0..{height-1}] init {initX};',
+		f'y : [0..{width-1}] init {initY};',
+		'end : bool init false;',
+		f"[North] (north & !win & !loss & !end) -> {w}/({w}+{s}*(eastInt+westInt)): (x'=x-1) + ({s}*eastInt)/({w}+{s}*(eastInt+westInt)): (y'=y+1) + ({s}*westInt)/({w}+{s}*(eastInt+westInt)): (y'=y-1);",
+		f"[South] (south & !win & !loss & !end) -> {w}/({w}+{s}*(eastInt+westInt)): (x'=x+1) + ({s}*eastInt)/({w}+{s}*(eastInt+westInt)): (y'=y+1) + ({s}*westInt)/({w}+{s}*(eastInt+westInt)): (y'=y-1);",
+		f"[East] (east & !win & !loss & !end) -> ({s}*northInt)/({w}+{s}*(northInt+southInt)): (x'=x-1) + ({s}*southInt)/({w}+{s}*(northInt+southInt)): (x'=x+1) + {w}/({w}+{s}*(northInt+southInt)): (y'=y+1);",
+		f"[West] (west & !win & !loss & !end) -> ({s}*northInt)/({w}+{s}*(northInt+southInt)): (x'=x-1) + ({s}*southInt)/({w}+{s}*(northInt+southInt)): (x'=x+1) + {w}/({w}+{s}*(northInt+southInt)): (y'=y-1);",
+		f"[] (win | loss) & !end -> 1 : (end'=true) & (x'={initX}) & (y'={initY});",
+		'endmodule',
+		'',
+		'rewards',
+		'[East] true : -1;',
+		'[West] true : -1;',
+		'[North] true : -1;',
+		'[South] true : -1;',
+		'(win & !end) : 100;',
+		'(loss & !end) : -100;',
+		'endrewards',
+		'',
+		'label "win" = win;',
+		'label "loss" = loss;',
+	]
+
+# Same MDP as prismStrFromGrids, with a text linear in the number of rows and runs of cells
+# instead of five constants and six clauses per cell. The win and loss states all go to a single
+# end state instead of one end state each, the values of the other states are the same.
+@instrumented("createPrismFile")
+def compactPrismStrFromGrids(walls,holes,targets,position):
+	height = len(walls)
+	width = len(walls[0])
+	moves = {
+		'north': [[i > 0 and not walls[i-1][j] for j in range(width)] for i in range(height)],
+		'south': [[i < height-1 and not walls[i+1][j] for j in range(width)] for i in range(height)],
+		'east': [[j < width-1 and not walls[i][j+1] for j in range(width)] for i in range(height)],
+		'west': [[j > 0 and not walls[i][j-1] for j in range(width)] for i in range(height)],
+	}
+	# as in prismStrFromGrids, the formulas also hold on walls, storm never reaches them
+	lines = ['mdp', '']
+	for name,cells in moves.items():
+		lines.append(f'formula {name} = {cellSetGuard(cells,height,width)};')
+	lines.append(f'formula win = {cellSetGuard(targets,height,width)};')
+	lines.append(f'formula loss = {cellSetGuard(holes,height,width)};')
+	lines += robotModuleLines(height,width,position[0],position[1])
+	return '\n'.join(lines)+'\n'
+
+def parsePrismStr(text):
+	# storm only parses files: the text goes through a temporary file of its own, removed at once,
+	# so that threads and processes never share a file and nothing is left on disk
+	fd, fname = tempfile.mkstemp(suffix='.nm', prefix='frozenLake_')
+	try:
+		with os.fdopen(fd,'w') as f:
+			f.write(text)
+		with phase("parse"):
+			return stormpy.parse_prism_program(fname)
+	finally:
+		os.remove(fname)
+
+# Compact model of every (height, width) layout. The walls, holes and targets of row i are the bits of
+# the undefined constants w{i}, h{i} and t{i}, the initial position is x0, y0. Storm parses it once per
+# grid size, each layout only defines the constants (createPrismProgramFromTemplate).
+TEMPLATE_MAX_WIDTH = 52 # the bits are read with floating point divisions
+
+def templatePrismStr(height,width):
+	if width > TEMPLATE_MAX_WIDTH:
+		raise Exception(f"The PRISM template supports grids of width up to {TEMPLATE_MAX_WIDTH}, not {width}")
+	lines = ['mdp', '']
+	for i in range(height):
+		lines.append(f'const int w{i}; const int h{i}; const int t{i};')
+	lines += ['const int x0;', 'const int y0;', '']
+	def cell(row,y): # bit y of the constant row(i) when x is i
+		return f"(mod(floor({indexTree('x',0,height,row)}/pow(2,{y})),2)=1)"
+	lines.append(f"formula north = x>0 & !{cell(lambda i: f'w{i-1}' if i > 0 else '0','y')};")
+	lines.append(f"formula south = x<{height-1} & !{cell(lambda i: f'w{i+1}' if i < height-1 else '0','y')};")
+	lines.append(f"formula east = y<{width-1} & !{cell(lambda i: f'w{i}','(y+1)')};")
+	lines.append(f"formula west = y>0 & !{cell(lambda i: f'w{i}','(y-1)')};")
+	lines.append(f"formula win = {cell(lambda i: f't{i}','y')};")
+	lines.append(f"formula loss = {cell(lambda i: f'h{i}','y')};")
+	lines += robotModuleLines(height,width,'x0','y0')
+	return '\n'.join(lines)+'\n'
+
+prismTemplates = {} # (height, width) -> (parsed template, its constants by name)
+
+def getPrismTemplate(height,width):
+	template = prismTemplates.get((height,width))
+	if template is None:
+		program = parsePrismStr(templatePrismStr(height,width))
+		template = (program, {constant.name: constant.expression_variable for constant in program.constants})
+		prismTemplates[(height,width)] = template
+	return template
+
+def createPrismProgramFromTemplate(walls,holes,targets,position):
+	# same MDP as compactPrismStrFromGrids, without parsing
+	height = len(walls)
+	width = len(walls[0])
+	program, constants = getPrismTemplate(height,width)
+	manager = program.expression_manager
+	with phase("defineConstants"):
+		values = {}
+		for i in range(height):
+			for name,grid in [('w',walls),('h',holes),('t',targets)]:
+				values[constants[f'{name}{i}']] = manager.create_integer(sum(1 << j for j in range(width) if grid[i][j]))
+		values[constants['x0']] = manager.create_integer(position[0])
+		values[constants['y0']] = manager.create_integer(position[1])
+		return program.define_constants(values)
+
+def createPrismProgramFromGrids(walls,holes,targets,position,initAction,compact = False):
+	if compact:
+		return parsePrismStr(compactPrismStrFromGrids(walls,holes,targets,position))
+	return parsePrismStr(prismStrFromGrids(walls,holes,targets,position))
+
+# Writes the PRISM text to a new file of TEMP_DIR and returns its path, to be removed by the caller.
+# The analysis functions take the PrismProgram of createPrismProgramFromGrids instead.
+def createPrismFilefFromGrids(walls,holes,targets,position,initAction,compact = False):
+	util.mkdir(TEMP_DIR)
+	text = compactPrismStrFromGrids(walls,holes,targets,position) if compact else prismStrFromGrids(walls,holes,targets,position)
+	fd, fname = tempfile.mkstemp(suffix=f'_{initAction}.nm', prefix=f'{os.getpid()}_', dir=TEMP_DIR)
+	with os.fdopen(fd,'w') as f:
+		f.write(text)
+	return fname
 
-def getValue(prismFile,formula_str = "Pmax=? [F win]"):
-	prism_program = stormpy.parse_prism_program(prismFile)
+# Returns what getValue and getDistValue expect: a parsed PRISM program or an already built SparseMdp
+def createModelFromGrids(walls,holes,targets,position,initAction,builder = PRISM_BUILDER):
+	if builder == PRISM_BUILDER:
+		return createPrismProgramFromGrids(walls,holes,targets,position,initAction)
+	elif builder == COMPACT_BUILDER:
+		return createPrismProgramFromGrids(walls,holes,targets,position,initAction,compact=True)
+	elif builder == TEMPLATE_BUILDER:
+		return createPrismProgramFromTemplate(walls,holes,targets,position)
+	elif builder == SPARSE_BUILDER:
+		return createSparseMdpFromGrids(walls,holes,targets,position)
+	elif builder == PRUNED_BUILDER:
+		return createPrunedMdpFromGrids(walls,holes,targets,position)
+	else:
+		raise Exception("Unknown builder: "+str(builder))
+
+def buildModel(prismFile,formula_str,stateValuations = False): # prismFile can also be a PrismProgram or a SparseMdp
+	if isinstance(prismFile, stormpy.storage.SparseMdp):
+		return prismFile, parseProperties(formula_str)
+	prism_program = loadPrismProgram(prismFile)
+	properties = stormpy.parse_properties(formula_str, prism_program)
+	with phase("build") as buildPhase:
+		if stateValuations:
+			options = stormpy.BuilderOptions([p.raw_formula for p in properties])
+			options.set_build_state_valuations()
+			model = stormpy.build_sparse_model_with_options(prism_program, options)
+		else:
+			model = stormpy.build_model(prism_program, properties)
+		buildPhase.model(model)
+	return model, properties
+
+def getSymbolicValue(prismFile,formula_str,options): # getValue with the dd or hybrid engine of options
+	prism_program = loadPrismProgram(prismFile)
 	properties = stormpy.parse_properties(formula_str, prism_program)
-	model = stormpy.build_model(prism_program, properties)
+	model = stormpy.build_symbolic_model(prism_program, properties)
+	if options.engine == 'dd':
+		result = stormpy.check_model_dd(model, properties[0], only_initial_states=True, environment=options.getEnvironment())
+	else:
+		result = stormpy.check_model_hybrid(model, properties[0], only_initial_states=True, environment=options.getEnvironment())
+	result.filter(stormpy.create_filter_initial_states_symbolic(model))
+	return result.min
+
+def getValue(prismFile,formula_str = "Pmax=? [F win]",key = None,options = None): # key: layoutHash of the grids, to use the result store; options: StormOptions
+	query = queryKey(optionsQuery("getValue",options),formula_str)
+	value = getStored(key, query)
+	if value is not None:
+		return value
+	if options is not None and options.engine != 'sparse':
+		if isinstance(prismFile, stormpy.storage.SparseMdp):
+			raise Exception("The "+options.engine+" engine needs a PRISM program")
+		value = getSymbolicValue(prismFile,formula_str,options)
+		putStored(key, query, value)
+		return value
+	model, properties = buildModel(prismFile,formula_str)
 	# print(model)
-	result = stormpy.model_checking(model, properties[0],only_initial_states=True)
+	result = modelChecking(model, properties[0], options, only_initial_states=True)
 	# assert result.result_for_all_states
 	initial_state = model.initial_states[0]
 	value = result.at(initial_state)
@@ -130,34 +351,125 @@ def getValue(prismFile,formula_str = "Pmax=? [F win]"):
 	# del result
 	# del initial_state
 	gc.collect()
+	putStored(key, query, value)
 	return(value)
 
-def getAllValuesFromGrids(walls,holes,targets,position):
+def getPositionValues(prismFile,formula_str = "Pmax=? [F win]",options = None): # getValue for all positions at once, options: StormOptions
+	if options is not None and options.engine != 'sparse':
+		raise Exception("The values of all positions need the sparse engine, not "+options.engine)
+	model, properties = buildModel(prismFile,formula_str,stateValuations=True)
+	result = modelChecking(model, properties[0], options)
+	values = {}
+	for state,position in getStatePositions(model).items():
+		values[position] = result.at(state)
+	del model
+	gc.collect()
+	return values
+
+# One step Bellman backups: the value of playing an action from position and then following the optimal strategy
+
+def getActionValues(positionValues,walls,position): # positionValues maps positions to probabilities
 	values = []
-	for i in range(1,5):
-		prismFile = createPrismFilefFromGrids(walls,holes,targets,position, i)
-		value = getValue(prismFile)
+	for action in ACTIONS:
+		value = 0.0
+		if isLegalAction(position,action,walls):
+			for label,probability in getStochasticDistribution(position,walls,action):
+				value += probability*positionValues[getNextPosition(position,label)]
 		values.append(value)
-		# if DEBUG == True:
-		# 	print(prismFile)
-		# else:
-		# 	os.system("rm "+prismFile)
 	return values
 
-def getAllDistValuesFromGrids(walls,holes,targets,position):
+def getActionDistValues(positionValues,walls,position): # positionValues maps positions to (probability, distance, storm distance)
 	values = []
-	for i in range(1,5):
-		prismFile = createPrismFilefFromGrids(walls,holes,targets,position, i)
-		formula1 = "Pmax=? [F win]"
-		formula2 = "Tmin=? [F win]"
-		value = getDistValue(prismFile,formula1,formula2)
-		values.append(value)
-		# if DEBUG == True:
-		# 	print(prismFile)
-		# else:
-		# 	os.system("rm "+prismFile)
+	for action in ACTIONS:
+		value = 0.0
+		distance = 0.0
+		distanceStorm = 0.0
+		if isLegalAction(position,action,walls):
+			for label,probability in getStochasticDistribution(position,walls,action):
+				nextValue,nextDistance,nextDistanceStorm = positionValues[getNextPosition(position,label)]
+				if nextValue > 0: # the distances are conditioned on winning
+					value += probability*nextValue
+					distance += probability*nextValue*nextDistance
+					distanceStorm += probability*nextValue*nextDistanceStorm
+		if value > 0:
+			values.append((value,1+distance/value,1+distanceStorm/value))
+		else:
+			values.append((0.0,math.inf,math.inf))
 	return values
 
+def getAllValuesFromGrids(walls,holes,targets,position,builder = PRISM_BUILDER,options = None):
+	# probability to win for each first action East, West, North, South, from a single model checking call
+	prismFile = createModelFromGrids(walls,holes,targets,position,0,builder)
+	positionValues = getPositionValues(prismFile,options=options)
+	return getActionValues(positionValues,walls,position)
+
+def getAllDistValuesFromGrids(walls,holes,targets,position,builder = PRISM_BUILDER,options = None):
+	# (probability, distance, storm distance) for each first action East, West, North, South, from a single analysis
+	prismFile = createModelFromGrids(walls,holes,targets,position,0,builder)
+	formula1 = "Pmax=? [F win]"
+	formula2 = "Tmin=? [F win]"
+	positionValues = getDistPositionValues(prismFile,formula1,formula2,options)
+	return getActionDistValues(positionValues,walls,position)
+
+def getValueGridsFromGrids(walls,holes,targets,position,builder = PRISM_BUILDER):
+	# (height, width) grids of probability, distance and storm distance from a single analysis,
+	# NaN for walls and for cells that are not reachable from position
+	prismFile = createModelFromGrids(walls,holes,targets,position,0,builder)
+	with ConditionalMinDistSession(prismFile) as session:
+		return session.getValueGrids(len(walls),len(walls[0]))
+
+class StormOracle():
+	"""
+	Action values of every position of a layout, from one analysis instead of one per query.
+	The model is built from the first queried position and checked for all its states;
+	a position that is not in the model (not reachable from there) triggers one more analysis.
+	The cells with Pmax = 0 get value 0 for every action without looking at their successors,
+	the pruned builder leaves out the cells that are only reachable through them.
+	"""
+	def __init__(self,walls,holes,targets,builder = PRISM_BUILDER,options = None): # options: StormOptions of the model checking calls
+		from frozenLakeNative import positiveGrid
+		self.walls = walls
+		self.holes = holes
+		self.targets = targets
+		self.builder = builder
+		self.options = options
+		self.zero = ~positiveGrid(walls,holes,targets) # cells with Pmax = 0, walls included
+		self.actionValues = {} # position -> probability for East, West, North, South
+		self.actionDistValues = {} # position -> (probability, distance, storm distance) for East, West, North, South
+
+	def isTerminal(self,position):
+		x,y = position
+		return self.holes[x][y] or self.targets[x][y]
+
+	def isZero(self,position):
+		return bool(self.zero[position[0],position[1]])
+
+	def getActionValues(self,position):
+		if position not in self.actionValues:
+			prismFile = createModelFromGrids(self.walls,self.holes,self.targets,position,0,self.builder)
+			positionValues = getPositionValues(prismFile,options=self.options)
+			for p in positionValues:
+				if self.isTerminal(p): # no action is played from a terminal position
+					self.actionValues[p] = [positionValues[p] for action in ACTIONS]
+				elif self.isZero(p):
+					self.actionValues[p] = [0.0 for action in ACTIONS]
+				else:
+					self.actionValues[p] = getActionValues(positionValues,self.walls,p)
+		return self.actionValues[position]
+
+	def getActionDistValues(self,position):
+		if position not in self.actionDistValues:
+			prismFile = createModelFromGrids(self.walls,self.holes,self.targets,position,0,self.builder)
+			positionValues = getDistPositionValues(prismFile,"Pmax=? [F win]","Tmin=? [F win]",self.options)
+			for p in positionValues:
+				if self.isTerminal(p):
+					self.actionDistValues[p] = [positionValues[p] for action in ACTIONS]
+				elif self.isZero(p): # as getActionDistValues when no successor can win
+					self.actionDistValues[p] = [(0.0,math.inf,math.inf) for action in ACTIONS]
+				else:
+					self.actionDistValues[p] = getActionDistValues(positionValues,self.walls,p)
+		return self.actionDistValues[position]
+
 if __name__ == "__main__":
 	layout = "Layout/1_10x10_1.lay"
 	# prismFile = "prism20081_3.nm"
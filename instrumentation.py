@@ -0,0 +1,151 @@
+# instrumentation.py
+
+# Opt-in timing of the phases of the analysis pipeline: PRISM emission, parse, build, model
+# checking and the loops of ConditionalMinDistEngine. Each phase records its wall time, its
+# number of calls, the size of the model it produced or checked and, optionally, the memory
+# allocated by python during the phase (tracemalloc does not see the allocations of storm).
+# The records are aggregated per process.
+#
+# It is enabled for a block with
+#	with instrument(callback) as instrumentation:
+#		...
+#	instrumentation.records()
+# or for a whole run by setting FROZENLAKE_INSTRUMENT to a file, to which every process appends
+# its records as JSON lines when it exits normally ("-" prints a summary to stderr instead).
+# The workers of a multiprocessing.Pool exit normally when they reach maxtasksperchild or when
+# the pool is closed and joined; the records of workers killed by pool.terminate() are lost.
+# FROZENLAKE_INSTRUMENT_ALLOCATIONS=1 also traces the allocations.
+# When it is disabled, a phase costs one test of a global.
+
+import os, sys, time, json, functools, tracemalloc
+import multiprocessing.util
+
+INSTRUMENT_ENV = 'FROZENLAKE_INSTRUMENT'
+ALLOCATIONS_ENV = 'FROZENLAKE_INSTRUMENT_ALLOCATIONS'
+
+class Instrumentation():
+
+	def __init__(self, callback = None, allocations = False, output = None):
+		self.callback = callback # called with the record of every call of a phase
+		self.allocations = allocations # python allocations, with tracemalloc
+		self.output = output # file written when the process exits, None to keep the records in memory
+		self.reset()
+
+	def reset(self):
+		self.pid = os.getpid()
+		self.stats = {} # phase -> [calls, time, allocated, states, choices, transitions]
+		if self.output is not None: # also run by the workers of a multiprocessing.Pool, unlike atexit
+			multiprocessing.util.Finalize(None, self.dump, exitpriority=10)
+
+	def record(self, name, elapsed, allocated, sizes):
+		if self.pid != os.getpid(): # a forked process starts with no records
+			self.reset()
+		stats = self.stats.get(name)
+		if stats is None:
+			stats = self.stats[name] = [0, 0.0, 0, 0, 0, 0]
+		stats[0] += 1
+		stats[1] += elapsed
+		stats[2] += allocated
+		for i,size in enumerate(sizes):
+			stats[3+i] = max(stats[3+i], size)
+		if self.callback is not None:
+			self.callback({"pid": self.pid, "phase": name, "time": elapsed, "allocated": allocated, "states": sizes[0], "choices": sizes[1], "transitions": sizes[2]})
+
+	def records(self): # one dict per phase, sizes are the largest seen
+		return [{"pid": self.pid, "phase": name, "calls": stats[0], "time": stats[1], "allocated": stats[2], "states": stats[3], "choices": stats[4], "transitions": stats[5]} for name,stats in self.stats.items()]
+
+	def dump(self):
+		if self.pid != os.getpid() or self.stats == {}:
+			return
+		if self.output == "-":
+			printSummary(self.records(), file = sys.stderr)
+			return
+		with open(self.output, "a") as f:
+			for record in self.records():
+				print(json.dumps(record), file = f)
+
+class Phase():
+	__slots__ = ["instrumentation", "name", "sizes", "t0", "memory0"]
+
+	def __init__(self, instrumentation, name):
+		self.instrumentation = instrumentation
+		self.name = name
+		self.sizes = (0, 0, 0)
+
+	def model(self, model): # records the size of a storm model
+		self.sizes = (model.nr_states, model.nr_choices, model.nr_transitions)
+		return model
+
+	def __enter__(self):
+		self.memory0 = tracemalloc.get_traced_memory()[0] if self.instrumentation.allocations else 0
+		self.t0 = time.perf_counter()
+		return self
+
+	def __exit__(self, *args):
+		elapsed = time.perf_counter()-self.t0
+		allocated = tracemalloc.get_traced_memory()[0]-self.memory0 if self.instrumentation.allocations else 0
+		self.instrumentation.record(self.name, elapsed, allocated, self.sizes)
+
+class NullPhase():
+
+	def model(self, model):
+		return model
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		pass
+
+NULL_PHASE = NullPhase()
+
+active = None # Instrumentation in use, None when disabled
+
+def phase(name): # context manager timing a phase
+	if active is None:
+		return NULL_PHASE
+	return Phase(active, name)
+
+def instrumented(name): # decorator timing every call of a function as a phase
+	def decorator(function):
+		@functools.wraps(function)
+		def wrapper(*args, **kwargs):
+			if active is None:
+				return function(*args, **kwargs)
+			with Phase(active, name):
+				return function(*args, **kwargs)
+		return wrapper
+	return decorator
+
+class instrument():
+	"""
+	Enables the instrumentation inside a with block, and returns the Instrumentation.
+	The instrumentation in use before the block is restored at its end.
+	"""
+	def __init__(self, callback = None, allocations = False):
+		self.instrumentation = Instrumentation(callback, allocations)
+
+	def __enter__(self):
+		global active
+		self.previous = active
+		self.startedTracing = self.instrumentation.allocations and not tracemalloc.is_tracing()
+		if self.startedTracing:
+			tracemalloc.start()
+		active = self.instrumentation
+		return self.instrumentation
+
+	def __exit__(self, *args):
+		global active
+		active = self.previous
+		if self.startedTracing:
+			tracemalloc.stop()
+
+def printSummary(records, file = sys.stdout):
+	print(f"{'pid':>7} {'phase':<28} {'calls':>7} {'time':>9} {'allocated MB':>12} {'states':>8} {'choices':>8} {'transitions':>11}", file = file)
+	for r in sorted(records, key = lambda r: (r["pid"], -r["time"])):
+		print(f"{r['pid']:>7} {r['phase']:<28} {r['calls']:>7} {r['time']:>9.3f} {r['allocated']/2**20:>12.1f} {r['states']:>8} {r['choices']:>8} {r['transitions']:>11}", file = file)
+
+if os.environ.get(INSTRUMENT_ENV):
+	active = Instrumentation(allocations = os.environ.get(ALLOCATIONS_ENV) == "1", output = os.environ[INSTRUMENT_ENV])
+	if active.allocations:
+		tracemalloc.start()
@@ -0,0 +1,105 @@
+# resultStore.py
+
+# SQLite store of analysis results, keyed by the hash of the layout (frozenLake.layoutHash)
+# and by the query (the function and its formulas), so that a layout is solved once whatever
+# its file name. Several processes can read and write the same store at the same time.
+#
+# The store is off by default. It is enabled with setResultStore(fname) or by setting the
+# environment variable FROZENLAKE_RESULT_STORE to the path of the database, which is also
+# how the worker processes of a batch inherit it.
+
+import sqlite3, os, sys, json, argparse
+
+RESULT_STORE_ENV = 'FROZENLAKE_RESULT_STORE'
+RESULTS_HEADER = "layout, probability, opt cond exp dist, cond exp dist storm"
+
+def queryKey(name, *formulas):
+	# formulas are compared without their spacing
+	return "|".join([name]+[" ".join(formula.split()) for formula in formulas])
+
+class ResultStore():
+
+	def __init__(self, fname, timeout = 60.0):
+		self.fname = fname
+		self.timeout = timeout
+		self.connection = None
+		self.pid = None
+
+	def connect(self):
+		# connections are not shared with forked processes
+		if self.connection is None or self.pid != os.getpid():
+			self.connection = sqlite3.connect(self.fname, timeout=self.timeout, isolation_level=None)
+			self.connection.execute("PRAGMA journal_mode=WAL")
+			self.connection.execute(f"PRAGMA busy_timeout={int(self.timeout*1000)}")
+			self.connection.execute("CREATE TABLE IF NOT EXISTS results (layout TEXT, query TEXT, value TEXT, PRIMARY KEY (layout, query))")
+			self.connection.execute("CREATE TABLE IF NOT EXISTS layouts (name TEXT PRIMARY KEY, layout TEXT)")
+			self.pid = os.getpid()
+		return self.connection
+
+	def get(self, layout, query): # None if the result is not stored
+		row = self.connect().execute("SELECT value FROM results WHERE layout = ? AND query = ?", (layout, query)).fetchone()
+		if row is None:
+			return None
+		return json.loads(row[0])
+
+	def put(self, layout, query, value):
+		self.connect().execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)", (layout, query, json.dumps(value)))
+
+	def addLayout(self, name, layout): # remembers the file name of a layout hash, for the export
+		self.connect().execute("INSERT OR REPLACE INTO layouts VALUES (?, ?)", (name, layout))
+
+	def exportCsv(self, fname, formula1 = "Pmax=? [F win]", formula2 = "Tmin=? [F win]"):
+		# same columns as results.csv, for the named layouts whose values are stored
+		query = queryKey("getDistValue", formula1, formula2)
+		rows = self.connect().execute("SELECT layouts.name, results.value FROM layouts JOIN results ON layouts.layout = results.layout WHERE results.query = ? ORDER BY layouts.name", (query,)).fetchall()
+		f = open(fname,"w")
+		print(RESULTS_HEADER,file=f)
+		for name, value in rows:
+			v = json.loads(value)
+			print(f"{name}, {v[0]}, {v[1]}, {v[2]}",file=f)
+		f.close()
+		return len(rows)
+
+	def close(self):
+		if self.connection is not None and self.pid == os.getpid():
+			self.connection.close()
+		self.connection = None
+
+resultStore = None
+
+def setResultStore(fname): # None disables the store
+	global resultStore
+	if resultStore is not None:
+		resultStore.close()
+	resultStore = None if fname is None else ResultStore(fname)
+	if fname is None:
+		os.environ.pop(RESULT_STORE_ENV, None)
+	else:
+		os.environ[RESULT_STORE_ENV] = fname
+
+def getResultStore(): # the store in use, or None
+	global resultStore
+	fname = os.environ.get(RESULT_STORE_ENV)
+	if fname is None or fname == "":
+		return None
+	if resultStore is None or resultStore.fname != fname:
+		resultStore = ResultStore(fname)
+	return resultStore
+
+def getStored(layout, query):
+	store = getResultStore()
+	if store is None or layout is None:
+		return None
+	return store.get(layout, query)
+
+def putStored(layout, query, value):
+	store = getResultStore()
+	if store is not None and layout is not None:
+		store.put(layout, query, value)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Exports a result store to the columns of results.csv")
+	parser.add_argument("store")
+	parser.add_argument("--output", default="results.csv")
+	args = parser.parse_args()
+	print(f"{ResultStore(args.store).exportCsv(args.output)} rows written to {args.output}", file=sys.stderr)
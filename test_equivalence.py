@@ -0,0 +1,127 @@
+# test_equivalence.py
+
+# Checks that the faster paths give the same values as the reference ones on the shipped layouts:
+# native vs storm engine, vectorized vs loop conditioning, incremental vs full re-solve,
+# sparse, pruned and compact builders vs the PRISM file, and the tables of MDPOperations
+# vs the position functions they replace. Run with python -m pytest test_equivalence.py
+
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip("stormpy")
+
+from frozenLake import gridsFromFile, getNextPosition, getStochasticDistribution
+from frozenLakeNative import NativeConditionalMinDistEngine, CompiledLayout, IncrementalAnalysis, applyCellEdits, PMAX_FORMULA, TMIN_FORMULA, WALL, HOLE, TARGET, EMPTY
+from frozenLakeStorm import createModelFromGrids, getAllDistValuesFromGrids, PRISM_BUILDER, COMPACT_BUILDER, SPARSE_BUILDER, PRUNED_BUILDER
+from frozenLakeSparse import createSparseMdpFromGrids, compareOracles
+from conditionalMinDist import ConditionalMinDistEngine, ConditionalMinDistSession, StormOptions
+
+CURRENTPWD = os.path.dirname(os.path.abspath(__file__))
+LAYOUTS = [os.path.join(CURRENTPWD, "layout", str(i)+"_10x10_0.lay") for i in range(1,6)] # one layout of each family
+
+# values solved by value iteration, in two different ways, are compared up to these tolerances
+RTOL = 1e-4
+ATOL = 1e-6
+PRECISION = 1e-9
+
+@pytest.fixture(autouse=True)
+def tempDir(tmp_path, monkeypatch):
+	# the PRISM builders write their files in tempFiles, relative to the working directory
+	monkeypatch.chdir(tmp_path)
+
+def freeCells(walls):
+	return [(i,j) for i in range(len(walls)) for j in range(len(walls[0])) if not walls[i][j]]
+
+def assertGridsClose(actual, expected):
+	actual, expected = np.asarray(actual, dtype=float), np.asarray(expected, dtype=float)
+	assert actual.shape == expected.shape
+	assert (np.isnan(actual) == np.isnan(expected)).all()
+	assert (np.isinf(actual) == np.isinf(expected)).all()
+	finite = np.isfinite(expected)
+	np.testing.assert_allclose(actual[finite], expected[finite], rtol=RTOL, atol=ATOL)
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+def test_nativeMatchesStorm(layout):
+	walls, holes, targets, position = gridsFromFile(layout)
+	# both stop value iteration at a relative difference of precision between two iterations,
+	# the long distances are only that close with a smaller precision than the default
+	native = NativeConditionalMinDistEngine(CompiledLayout(walls, holes, targets, position), PRECISION)
+	native.process(PMAX_FORMULA, TMIN_FORMULA)
+	model = createModelFromGrids(walls, holes, targets, position, 0, PRISM_BUILDER)
+	with ConditionalMinDistSession(model, PMAX_FORMULA, TMIN_FORMULA, options=StormOptions(precision=PRECISION)) as session:
+		expected = session.getValueGrids(len(walls), len(walls[0]))
+	reachable = ~np.isnan(expected[0]) # storm only has the cells reachable from position
+	for actual, grid in zip(native.getValueGrids()[:2], expected[:2]): # the storm strategy distance depends on how ties are broken
+		assertGridsClose(np.where(reachable, actual, np.nan), grid)
+	np.testing.assert_allclose(native.getFinalValues()[:2], [expected[0][position], expected[1][position]], rtol=RTOL, atol=ATOL)
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+def test_vectorizedMatchesLoop(layout):
+	walls, holes, targets, position = gridsFromFile(layout)
+	model = createSparseMdpFromGrids(walls, holes, targets, position)
+	grids = []
+	for vectorized in [True, False]:
+		engine = ConditionalMinDistEngine(model, vectorized)
+		engine.process(PMAX_FORMULA, TMIN_FORMULA)
+		grids.append(engine.getValueGrids(len(walls), len(walls[0])))
+	for actual, expected in zip(*grids):
+		assertGridsClose(actual, expected)
+
+def cellEdits(walls, holes, targets):
+	# a few edits of each kind: removing a hole, adding one, moving a target, removing and adding walls
+	height, width = len(walls), len(walls[0])
+	empty = [(i,j) for i,j in freeCells(walls) if not holes[i][j] and not targets[i][j]]
+	holeCells = [(i,j) for i,j in freeCells(walls) if holes[i][j]]
+	targetCells = [(i,j) for i,j in freeCells(walls) if targets[i][j]]
+	innerWalls = [(i,j) for i in range(1,height-1) for j in range(1,width-1) if walls[i][j]]
+	edits = [[(holeCells[0], EMPTY)], [(empty[0], HOLE)], [(targetCells[0], EMPTY), (empty[-1], TARGET)], [(empty[len(empty)//2], WALL)]]
+	if innerWalls != []:
+		edits.append([(innerWalls[0], EMPTY)])
+	return edits
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+def test_incrementalMatchesFullSolve(layout):
+	walls, holes, targets, position = gridsFromFile(layout)
+	# the two solves start value iteration from different values, so they stop at different approximations
+	analysis = IncrementalAnalysis(walls, holes, targets, PRECISION)
+	for edits in cellEdits(walls, holes, targets):
+		expected = IncrementalAnalysis(*applyCellEdits(walls, holes, targets, edits), PRECISION).getValueGrids()
+		for actual, grid in zip(analysis.edited(edits).getValueGrids()[:2], expected[:2]): # the storm strategy distance depends on how ties are broken
+			assertGridsClose(actual, grid)
+
+@pytest.mark.parametrize("builder", [COMPACT_BUILDER, SPARSE_BUILDER, PRUNED_BUILDER])
+@pytest.mark.parametrize("layout", LAYOUTS)
+def test_builderMatchesPrism(layout, builder):
+	walls, holes, targets, position = gridsFromFile(layout)
+	expected = getAllDistValuesFromGrids(walls, holes, targets, position, PRISM_BUILDER)
+	actual = getAllDistValuesFromGrids(walls, holes, targets, position, builder)
+	assertGridsClose(np.array(actual)[:,:2], np.array(expected)[:,:2])
+
+@pytest.mark.parametrize("layout", LAYOUTS[:2])
+def test_stormOracleEveryCell(layout):
+	assert compareOracles([(layout, gridsFromFile(layout))]) == []
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+def test_mdpOperationsTables(layout):
+	pytest.importorskip("tensorflow")
+	pytest.importorskip("adviceMCTS.util")
+	import frozenLakeMdpClasses as mdpClasses
+	walls, holes, targets, position = gridsFromFile(layout)
+	mdpOperations = mdpClasses.MDPOperations(walls, holes, targets, 40, 1)
+	for position in freeCells(walls):
+		mdpState = mdpClasses.MDPState(position)
+		labels = mdpClasses.getLegalActions(position, walls)
+		assert [a.action for a in mdpOperations.getLegalActions(mdpState)] == labels
+		x,y = position
+		assert mdpOperations.terminalCells[mdpOperations.getCell(mdpState)] == bool(holes[x][y] or targets[x][y] or labels == [])
+		assert sorted([p.name for p in mdpOperations.getPredicates(mdpState)]) == sorted((["Loss"] if holes[x][y] else [])+(["Win"] if targets[x][y] else []))
+		for label in labels:
+			distribution = mdpOperations.getDistribution(mdpState, mdpClasses.MDPAction(label, ""))
+			expected = dict(getStochasticDistribution(position, walls, label))
+			assert sorted([a.action for a in distribution]) == sorted(expected)
+			for a in distribution:
+				assert distribution[a] == pytest.approx(expected[a.action])
+				nextState = mdpState.deepCopy()
+				mdpOperations.applyTransitionOnState(nextState, mdpClasses.MDPTransition(mdpClasses.MDPAction(label, ""), a))
+				assert nextState.position == getNextPosition(position, a.action)
@@ -1,6 +1,8 @@
-import stormpy, glob
+import stormpy, glob, os, sys, argparse, multiprocessing, functools
 from conditionalMinDist import *
-from frozenLakeMdpClasses import createPrismFile
+from frozenLake import gridsFromFile, layoutHash
+from frozenLakeStorm import createModelFromGrids, PRISM_BUILDER, COMPACT_BUILDER, TEMPLATE_BUILDER
+from resultStore import getResultStore, setResultStore, getStored, putStored, queryKey
 
 # def investigateModel(model): # this is for debugging
 # 	for state in model.states:
@@ -17,51 +19,111 @@ from frozenLakeMdpClasses import createPrismFile
 # 	for state in model.states:
 # 		print("State", state, "has label:", model.labeling.get_labels_of_state(state))
 
-def getOptDist(prismFile, formula_str1, formula_str2):
-	# formula_str1 = "Pmax=? [F win]"
-	program = stormpy.parse_prism_program(prismFile)
-	formulas = stormpy.parse_properties_for_prism_program(formula_str1, program)
-	model = stormpy.build_model(program, formulas)
-	# print(model)
-	result = stormpy.model_checking(model, formulas[0], extract_scheduler=True)
-	assert result.has_scheduler
-	scheduler = result.scheduler
-	print(type(scheduler))
-	# print(scheduler)
-	assert scheduler.memoryless
-	assert scheduler.deterministic
-	dtmc = model.apply_scheduler(scheduler)
-	assert dtmc.model_type == stormpy.ModelType.MDP
-	for state in dtmc.states:
-			assert len(state.actions) == 1
-	formulas = stormpy.parse_properties_for_prism_program(formula_str2, program)
-	result = stormpy.model_checking(dtmc, formulas[0], extract_scheduler=True)
-	# assert result.has_scheduler
-	initial_state = dtmc.initial_states[0]
-	value = result.at(initial_state)
+def getOptDist(prismFile, formula_str1, formula_str2, key = None, options = None): # key: layoutHash of the grids, to use the result store; options: StormOptions
+	query = queryKey(optionsQuery("getOptDist", options), formula_str1, formula_str2)
+	value = getStored(key, query)
+	if value is not None:
+		return value
+	with ConditionalMinDistSession(prismFile, formula_str1, formula_str2, options=options) as session:
+		value = session.getOptDist()
+	putStored(key, query, value)
 	return value
 
 
 
+RESULTS_HEADER = "layout, probability, opt cond exp dist, cond exp dist storm"
+
+def evaluateLayout(layout, formula_str1 = "Pmax=? [F win]", formula_str2 = 'Tmin=? [F win]', options = None, builder = COMPACT_BUILDER):
+	# one row of results.csv and the distance of storm's optimal strategy, or the error
+	try:
+		walls, holes, targets, position = gridsFromFile(layout)
+		key = layoutHash(walls,holes,targets,position)
+		store = getResultStore()
+		if store is not None:
+			store.addLayout(layout, key)
+		distQuery = queryKey(optionsQuery("getDistValue", options), formula_str1, formula_str2)
+		optQuery = queryKey(optionsQuery("getOptDist", options), formula_str1, formula_str2)
+		v = getStored(key, distQuery)
+		optDist = getStored(key, optQuery)
+		if v is None or optDist is None: # one parse and one build for all the values
+			prismFile = createModelFromGrids(walls,holes,targets,position,0,builder)
+			with ConditionalMinDistSession(prismFile, formula_str1, formula_str2, options=options) as session:
+				if v is None:
+					v = session.getFinalValues()
+					putStored(key, distQuery, v)
+				if optDist is None:
+					optDist = session.getOptDist()
+					putStored(key, optQuery, optDist)
+		return layout, f"{layout}, {v[0]}, {v[1]}, {v[2]}", optDist, None
+	except Exception as error:
+		return layout, None, None, f"{type(error).__name__}: {error}"
+
+def readCompletedLayouts(output):
+	# layouts of the complete rows of an interrupted run; the file is rewritten without a truncated last row
+	if not os.path.exists(output):
+		return set()
+	f = open(output)
+	lines = f.read().split("\n")
+	f.close()
+	rows = [line for line in lines[1:] if len(line.split(",")) == len(RESULTS_HEADER.split(","))]
+	if lines[-1] != "" and rows != [] and rows[-1] == lines[-1]: # the last row was not terminated
+		rows = rows[:-1]
+	f = open(output,"w")
+	print(RESULTS_HEADER,file=f)
+	for row in rows:
+		print(row,file=f)
+	f.close()
+	return set([row.split(",")[0].strip() for row in rows])
+
+def runBatch(layouts, output = "results.csv", processes = None, restart = False, maxtasksperchild = 20, options = None, builder = COMPACT_BUILDER):
+	"""
+	Evaluates layouts in a process pool and appends each row to output as soon as it is done,
+	in completion order. Layouts already in output are skipped unless restart is True,
+	so a killed run continues where it stopped. Layouts that fail are reported on stderr
+	and are not written, so they are retried by the next run.
+	"""
+	if restart and os.path.exists(output):
+		os.remove(output)
+	completed = readCompletedLayouts(output)
+	todo = [layout for layout in layouts if layout not in completed]
+	print(f"{len(layouts)-len(todo)} layouts already done, {len(todo)} to go", file=sys.stderr)
+	f = open(output,"a")
+	if f.tell() == 0:
+		print(RESULTS_HEADER,file=f)
+	# workers are replaced regularly, storm does not give back all its memory
+	pool = multiprocessing.Pool(processes, maxtasksperchild=maxtasksperchild)
+	try:
+		for layout, row, optDist, error in pool.imap_unordered(functools.partial(evaluateLayout, options=options, builder=builder), todo):
+			if error is not None:
+				print(f"{layout} failed: {error}", file=sys.stderr)
+				continue
+			print(row,file=f)
+			f.flush()
+			print(f"{optDist},{row}")
+		# the workers exit normally and run their exit handlers, the instrumentation records are written there
+		pool.close()
+		pool.join()
+	except BaseException: # KeyboardInterrupt included
+		pool.terminate()
+		raise
+	finally:
+		f.close()
+
 def main():
-	layouts = glob.glob("layout/*.lay")
-	# layouts = glob.glob("test.lay")
-	f = open("results.csv","w")
-	print("layout, probability, opt cond exp dist, cond exp dist storm",file=f)
-	for layout in layouts:
-		# print(layout)
-		prismFile = createPrismFile(layout)
-		formula_str1 = "Pmax=? [F win]"
-		formula_str2 = 'Tmin=? [F win]'
-		# formula_str3 = "Tmax=? [F win]"
-		v = getDistValue(prismFile,formula_str1,formula_str2)
-		# v2 = getDistValue(prismFile,formula_str1,formula_str2)
-		# print("Storm",v1)
-		# print("our code",v2)
-		# v3 = getDistValue(prismFile,formula_str1,formula_str3)
-		print(f"{layout}, {v[0]}, {v[1]}, {v[2]}",file=f)
-		print(f"{getOptDist(prismFile, formula_str1, formula_str2)},{layout}, {v[0]}, {v[1]}, {v[2]}")
-		# print(f"{layout}, {v1[0]}, {v2[0]}, {v1[1]}, {v2[1]}, {v3[1]}")
+	parser = argparse.ArgumentParser(description="Computes results.csv for a set of layouts")
+	parser.add_argument("--layouts", default="layout/*.lay", help="glob of the layout files")
+	parser.add_argument("--output", default="results.csv")
+	parser.add_argument("--processes", type=int, default=None, help="size of the process pool, the number of cpus by default")
+	parser.add_argument("--restart", action="store_true", help="ignore the rows already in the output")
+	parser.add_argument("--store", default=None, help="sqlite result store, layouts already solved under any name are not solved again")
+	parser.add_argument("--method", default=None, choices=list(MINMAX_METHODS), help="MDP solver method of storm")
+	parser.add_argument("--precision", type=float, default=None, help="precision of the storm solvers")
+	parser.add_argument("--builder", default=COMPACT_BUILDER, choices=[PRISM_BUILDER, COMPACT_BUILDER, TEMPLATE_BUILDER], help="PRISM encoding of the layouts")
+	args = parser.parse_args()
+	if args.store is not None:
+		setResultStore(args.store) # inherited by the workers through the environment
+	options = StormOptions(args.method, args.precision)
+	runBatch(sorted(glob.glob(args.layouts)), args.output, args.processes, args.restart, options=options, builder=args.builder)
 
 if __name__ == "__main__":
-	main()
\ No newline at end of file
+	main()